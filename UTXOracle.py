@@ -57,21 +57,23 @@
  # efficiency, or for corporate team implementations. The purpose is to explain how
  # the UTXOracle algorithm works side by side with the code.
 
- # The code proceeds by completing the following 12 steps in order. Approximate line
+ # The code proceeds by completing the following 14 steps in order. Approximate line
  # numbers of the steps are listed for the user to jump directly there if desired.
  
 # Step 1 - Configuration Options...................Line 78
-# Step 2 - Establish RPC Connection................Line 206
-# Step 3 - Check Dates.............................Line 315
-# Step 4 - Find Block Hashes.......................Line 409
-# Step 5 - Initialize Histogram....................Line 589
-# Step 6 - Load Histogram from Transaction Data....Line 646
-# Step 7 - Remove Round Bitcoin Amounts............Line 889
-# Step 8 - Construct the Price Finding Stencil.....Line 971
-# Step 9 - Estimate a Rough Price..................Line 1049
-# Step 10 - Create Intraday Price Points...........Line 1160
-# Step 11 - Find the Exact Average Price...........Line 1260
-# Step 12 - Generate a Price Plot HTML Page........Line 1377
+# Step 2 - Establish RPC Connection................Line 318
+# Step 3 - Check Dates.............................Line 675
+# Step 4 - Find Block Hashes.......................Line 804
+# Step 5 - Initialize Histogram....................Line 975
+# Step 6 - Load Histogram from Transaction Data....Line 1044
+# Step 7 - Remove Round Bitcoin Amounts............Line 1643
+# Step 8 - Construct the Price Finding Stencil.....Line 1732
+# Step 9 - Estimate a Rough Price..................Line 1810
+# Step 10 - Create Intraday Price Points...........Line 1948
+# Step 11 - Find the Exact Average Price...........Line 2091
+# Step 12 - Generate a Price Plot HTML Page........Line 2232
+# Step 13 - Follow New Blocks......................Line 2667
+# Step 14 - Backfill Daily Prices..................Line 2996
 
 
 
@@ -89,7 +91,9 @@
 # when running the program to specify the correct block directory.
 
 # Other options let you specify the historical date you want to run (-h) or request the
-# price from the most recent 144 blocks (-rb). If you're an advanced user with
+# price from the most recent 144 blocks (-rb), and keep updating that price as new
+# blocks arrive (--daemon), or find the price of every day in a range of dates 
+# (--backfill). If you're an advanced user with
 # custom settings overriding the default RPC connection, the program will read your
 # bitcoin.conf file to use them. Otherwise, it will use the autogenerated cookie file for
 # authentication.
@@ -117,9 +121,32 @@ block_nums_needed = []
 block_hashes_needed = []
 block_times_needed = []
 
+# initialize variables for the node connection
+rpc_pool_size = 4
+rpc_batch_size = 500
+use_rest = True
+prefetch_depth = 4
+parse_workers = 1
+
+# initialize variables for files saved between runs
+cache_dir = os.path.join(os.path.expanduser("~"), ".utxoracle")
+use_cache = True
+block_cache_mb = 2000
+
+# initialize variables for following new blocks
+daemon_mode = False
+daemon_poll_seconds = 10
+notify_fifo = ""
+
+# initialize variables for finding the price of many days
+backfill_mode = False
+backfill_start = ""
+backfill_end = ""
+backfill_csv = "UTXOracle_backfill.csv"
+
 #print help text for the user if needed
 import sys
-def print_help():
+def print_help(exit_code=0):
     help_text = """
 Usage: python3 UTXOracle.py [options]
 
@@ -128,9 +155,34 @@ Options:
   -d YYYY/MM/DD    Specify a UTC date to evaluate
   -p /path/to/dir  Specify the data directory for blk files
   -rb              Use last 144 recent blocks instead of date mode
+  --rpc-pool N     Keep up to N reusable RPC connections open (default 4)
+  --rpc-batch N    Send up to N block lookups per RPC request (default 500)
+  --no-rest        Always download blocks through RPC instead of REST
+  --prefetch N     Download up to N blocks at once while parsing (default 4).
+                   With --workers, each process downloads its own blocks instead
+  --workers N      Parse blocks, or backfill days, on N processes at once (default 1)
+  --cache-dir DIR  Folder for files saved between runs (default ~/.utxoracle)
+  --no-cache       Don't read or save any files between runs
+  --cache-size MB  Keep up to MB megabytes of parsed blocks (default 2000). A day
+                   takes about 25 MB, so 2000 MB holds about 80 days.
+                   Use a larger size to rerun a longer --backfill from saved blocks
+  --daemon         Keep running and update the -rb price on every new block
+  --notify FIFO    With --daemon, wake up when bitcoind's blocknotify writes to FIFO
+  --backfill A B   Find the price of every day from date A to date B (YYYY/MM/DD)
+                   and save them in UTXOracle_backfill.csv
 """
     print(help_text)
-    sys.exit(0)
+    sys.exit(exit_code)
+
+#shortcut for reading the whole number after an option, showing the options to the
+#user if it's missing or isn't a number
+def read_number_option(option, minimum):
+    o_index = sys.argv.index(option)
+    try:
+        return max(minimum, int(sys.argv[o_index + 1]))
+    except (IndexError, ValueError):
+        print("\nError interpreting "+option+". Please try again. Make sure it's followed by a whole number")
+        print_help(1)
 
 #did use ask for help
 if "-h" in sys.argv:
@@ -153,6 +205,66 @@ if "-rb" in sys.argv:
     date_mode = False
     block_mode = True
 
+#did user specify how many rpc connections to keep open?
+if "--rpc-pool" in sys.argv:
+    rpc_pool_size = read_number_option("--rpc-pool", 1)
+
+#did user specify how many commands to send in each batch request?
+if "--rpc-batch" in sys.argv:
+    rpc_batch_size = read_number_option("--rpc-batch", 1)
+
+#did user turn off downloading blocks through the REST interface?
+if "--no-rest" in sys.argv:
+    use_rest = False
+
+#did user specify how many blocks to download ahead of the parser?
+if "--prefetch" in sys.argv:
+    prefetch_depth = read_number_option("--prefetch", 1)
+
+#did user specify how many processes should parse blocks?
+if "--workers" in sys.argv:
+    parse_workers = read_number_option("--workers", 1)
+
+#did user specify a folder for files saved between runs?
+if "--cache-dir" in sys.argv:
+    c_index = sys.argv.index("--cache-dir")
+    if c_index + 1 < len(sys.argv):
+        cache_dir = os.path.expanduser(sys.argv[c_index + 1])
+
+#did user ask not to save files between runs?
+if "--no-cache" in sys.argv:
+    use_cache = False
+
+#did user ask to keep running and follow new blocks?
+if "--daemon" in sys.argv:
+    daemon_mode = True
+    date_mode = False
+    block_mode = True
+
+#did user give a fifo for bitcoind's blocknotify command to write to?
+if "--notify" in sys.argv:
+    n_index = sys.argv.index("--notify")
+    if n_index + 1 < len(sys.argv):
+        notify_fifo = os.path.expanduser(sys.argv[n_index + 1])
+
+#did user ask for the price of every day in a range of dates?
+if "--backfill" in sys.argv:
+    k_index = sys.argv.index("--backfill")
+    if k_index + 2 < len(sys.argv):
+        backfill_start = sys.argv[k_index + 1]
+        backfill_end = sys.argv[k_index + 2]
+        backfill_mode = True
+        date_mode = False
+        block_mode = False
+        daemon_mode = False
+    else:
+        print("\nError interpreting --backfill. Please try again. Make sure it's followed by a start and end date YYYY/MM/DD")
+        print_help(1)
+
+#did user specify how much space parsed blocks can take up?
+if "--cache-size" in sys.argv:
+    block_cache_mb = read_number_option("--cache-size", 0)
+
 # Look for bitcoin.conf or bitcoin_rw.conf
 conf_path = None
 conf_candidates = ["bitcoin.conf", "bitcoin_rw.conf"]
@@ -220,6 +332,22 @@ if "rpcport" in conf_settings:
 # encountered. After defining the Ask_Node function, we test it by requesting the
 # latest block the node has received.
 
+# A single run makes several hundred requests, so instead of opening a new
+# connection and re-reading the cookie file for every request, we keep a small pool
+# of open connections to the node and reuse them (HTTP keep-alive). The cookie file
+# is only read again when it changes, which happens when the node restarts.
+
+# The node answers in JSON, which Ask_Node turns into ordinary python values: block
+# counts come back as integers, hashes as strings and block headers as dictionaries,
+# ready to be used without any further conversion.
+
+# Block headers that are buried under 6 or more blocks practically never change, so 
+# the program saves the height, hash and time of every such block in a small header 
+# index file. Each run only asks the node for the headers added since the last run, 
+# and the rest of the program looks up blocks in the index instead of asking the node. 
+# To handle chain reorganizations, the saved hashes at the tip of the index are 
+# compared with the node's before new headers are added.
+
 
 print("\nCurrent operation  \t\t\t\tTotal Completion",flush=True)
 print("\nConnecting to node...",flush=True)
@@ -229,24 +357,110 @@ print("0%..", end="",flush=True)
 import http.client
 import json
 import base64
+import queue
+import threading
 
-def Ask_Node(command, cred_creation):
-    method = command[0]
-    params = command[1:]
+# idle connections wait here until the next request, and the slots limit how
+# many connections can be open at the same time
+rpc_idle_connections = queue.LifoQueue()
+rpc_connection_slots = threading.BoundedSemaphore(rpc_pool_size)
 
-    # Handle authentication
-    rpc_u = rpc_user
-    rpc_p = rpc_password
+# the auth header is built once and rebuilt only if the cookie file changes
+rpc_auth_cache = {"header": None, "cookie_mtime": None}
 
-    if not rpc_u or not rpc_p:
-        try:
+def get_rpc_auth_header(reload_cookie=False):
+
+    # conf file credentials never change during a run
+    if rpc_user and rpc_password:
+        if rpc_auth_cache["header"] is None:
+            auth = base64.b64encode(f"{rpc_user}:{rpc_password}".encode()).decode()
+            rpc_auth_cache["header"] = f"Basic {auth}"
+        return rpc_auth_cache["header"]
+
+    # otherwise read the cookie file when it is new or has been rewritten
+    try:
+        cookie_mtime = os.stat(cookie_path).st_mtime_ns
+        if reload_cookie or cookie_mtime != rpc_auth_cache["cookie_mtime"]:
             with open(cookie_path, "r") as f:
                 cookie = f.read().strip()
                 rpc_u, rpc_p = cookie.split(":", 1)
-        except Exception as e:
-            print("Error reading .cookie file for RPC authentication.")
-            print("Details:", e)
-            sys.exit(1)
+            auth = base64.b64encode(f"{rpc_u}:{rpc_p}".encode()).decode()
+            rpc_auth_cache["header"] = f"Basic {auth}"
+            rpc_auth_cache["cookie_mtime"] = cookie_mtime
+    except Exception as e:
+        print("Error reading .cookie file for RPC authentication.")
+        print("Details:", e)
+        sys.exit(1)
+    return rpc_auth_cache["header"]
+
+# send one http request over a pooled connection and return the response
+def rpc_request(http_method, path, body, headers):
+    rpc_connection_slots.acquire()
+    try:
+        while True:
+
+            #reuse an idle connection if there is one, otherwise open a new one
+            try:
+                conn = rpc_idle_connections.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = http.client.HTTPConnection(rpc_host, rpc_port)
+                reused = False
+
+            try:
+                conn.request(http_method, path, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+
+                #the node may have closed an idle connection, so try again
+                if reused:
+                    continue
+                raise
+
+            #keep the connection for the next request unless the node closed it
+            if response.will_close:
+                conn.close()
+            else:
+                rpc_idle_connections.put(conn)
+            return response.status, response.reason, data
+    finally:
+        rpc_connection_slots.release()
+
+# a forked process starts with copies of the connections open in the main process, 
+# which it must not use, so it forgets them and opens its own
+def forget_parent_connections():
+    while True:
+        try:
+            rpc_idle_connections.get_nowait().close()
+        except queue.Empty:
+            break
+
+# post a json payload to the node's rpc interface and return the http status and raw reply
+def rpc_post_status(payload):
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": get_rpc_auth_header()
+    }
+    status, reason, raw_data = rpc_request("POST", "/", payload, headers)
+
+    #a restarted node writes a new cookie, so reload it and try once more
+    if status == 401 and not (rpc_user and rpc_password):
+        headers["Authorization"] = get_rpc_auth_header(reload_cookie=True)
+        status, reason, raw_data = rpc_request("POST", "/", payload, headers)
+    return status, reason, raw_data
+
+# post a json payload to the node's rpc interface and return the raw reply
+def rpc_post(payload):
+    status, reason, raw_data = rpc_post_status(payload)
+    if status != 200:
+        raise Exception(f"HTTP error {status} {reason}")
+    return raw_data
+
+def Ask_Node(command, cred_creation):
+    method = command[0]
+    params = command[1:]
 
     # Prepare JSON-RPC payload
     payload = json.dumps({
@@ -256,58 +470,204 @@ def Ask_Node(command, cred_creation):
         "params": params
     })
 
-    # Basic auth header
-    auth_header = base64.b64encode(f"{rpc_u}:{rpc_p}".encode()).decode()
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Basic {auth_header}"
-    }
-
     try:
-        conn = http.client.HTTPConnection(rpc_host, rpc_port)
-        conn.request("POST", "/", payload, headers)
-        response = conn.getresponse()
-        if response.status != 200:
-            raise Exception(f"HTTP error {response.status} {response.reason}")
-        raw_data = response.read()
-        conn.close()
-
-        # Extract result and mimic `subprocess.check_output` return (as bytes)
+        raw_data = rpc_post(payload)
+
+        # Extract the result as python values (int, str, dict or list)
         parsed = json.loads(raw_data)
         if parsed.get("error"):
             raise Exception(parsed["error"])
-        result = parsed["result"]
-        if isinstance(result, (dict, list)):
-            return json.dumps(result, indent=2).encode()  # pretty-print like CLI
-        else:
-            return str(result).encode()
+        return parsed["result"]
 
     except Exception as e:
         if not cred_creation:
-            print("Error connecting to your node via RPC. Troubleshooting steps:\n")
-            print("\t1) Ensure bitcoind or bitcoin-qt is running with server=1.")
-            print("\t2) Check rpcuser/rpcpassword or .cookie.")
-            print("\t3) Verify RPC port/host settings.")
-            print("\nThe attempted RPC method was:", method)
-            print("Parameters:", params)
-            print("\nThe error was:\n", e)
+            print_rpc_error(method, params, e)
             sys.exit(1)
 
+# send many commands to the node in one request (a JSON-RPC batch) and return
+# their results in the same order as the commands
+def Ask_Node_Batch(commands):
+    payload = json.dumps([{
+        "jsonrpc": "1.0",
+        "id": i,
+        "method": command[0],
+        "params": command[1:]
+    } for i, command in enumerate(commands)])
+
+    method = commands[0][0]
+    params = [command[1:] for command in commands]
+    try:
+        raw_data = rpc_post(payload)
+        results = [None] * len(commands)
+        for reply in json.loads(raw_data):
+            if reply.get("error"):
+                method = commands[reply["id"]][0]
+                params = commands[reply["id"]][1:]
+                raise Exception(reply["error"])
+            results[reply["id"]] = reply["result"]
+        return results
+
+    except Exception as e:
+        print_rpc_error(method, params, e)
+        sys.exit(1)
+
+def print_rpc_error(method, params, e):
+    print("Error connecting to your node via RPC. Troubleshooting steps:\n")
+    print("\t1) Ensure bitcoind or bitcoin-qt is running with server=1.")
+    print("\t2) Check rpcuser/rpcpassword or .cookie.")
+    print("\t3) Verify RPC port/host settings.")
+    print("\nThe attempted RPC method was:", method)
+    print("Parameters:", params)
+    print("\nThe error was:\n", e)
+
+#shortcuts for the node commands used in this program
+def get_block_count() -> int:
+    return Ask_Node(['getblockcount'], False)
+
+def get_block_hash(height: int) -> str:
+    return Ask_Node(['getblockhash', height], False)
+
+def get_block_header(block_hash: str) -> dict:
+    return Ask_Node(['getblockheader', block_hash, True], False)
+
+#shortcut for asking the node for the times and hashes of many blocks using batches
+def ask_node_block_times(heights):
+    times = []
+    hashes = []
+    for i in range(0, len(heights), rpc_batch_size):
+        batch_heights = heights[i:i+rpc_batch_size]
+        batch_hashes = Ask_Node_Batch([['getblockhash', h] for h in batch_heights])
+        batch_headers = Ask_Node_Batch([['getblockheader', bh, True] for bh in batch_hashes])
+        for block_header in batch_headers:
+            times.append(block_header['time'])
+            hashes.append(block_header['hash'])
+    return(times, hashes)
+
+# The header index holds one 40 byte record per block (height, hash, time) starting
+# at block 819000, which was mined before the earliest date UTXOracle supports
+import struct
+from array import array
+header_index_path = os.path.join(cache_dir, "header_index.dat")
+header_index_record = struct.Struct("<I32sI")
+header_index_start = 819000
+header_index_times = array('I')
+header_index_hashes = bytearray()
+
+#read the saved header index, keeping only the records that are in order
+def load_header_index():
+    try:
+        with open(header_index_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return
+    record_size = header_index_record.size
+    for height, raw_hash, block_time in header_index_record.iter_unpack(data[:len(data) - len(data) % record_size]):
+        if height != header_index_start + len(header_index_times):
+            break
+        header_index_hashes.extend(raw_hash)
+        header_index_times.append(block_time)
+    if len(header_index_times) * record_size != len(data):
+        truncate_header_index(len(header_index_times))
+
+#remove the records from a position to the end of the header index
+def truncate_header_index(count):
+    del header_index_times[count:]
+    del header_index_hashes[count*32:]
+    with open(header_index_path, "r+b") as f:
+        f.truncate(count * header_index_record.size)
+
+#shortcut for the hash of a block in the header index
+def header_index_hash(height):
+    k = height - header_index_start
+    return header_index_hashes[k*32:k*32+32].hex()
+
+#check the index against the node's chain and add any new headers up to last_height
+def update_header_index(last_height):
+    
+    #an index past the node's buried blocks is out of date, so trim it
+    count = len(header_index_times)
+    if header_index_start + count > last_height + 1:
+        count = max(0, last_height + 1 - header_index_start)
+    
+    #compare the first and last saved hashes with the node, stepping back until they match
+    check_size = 6
+    if count > 0 and header_index_hash(header_index_start) != get_block_hash(header_index_start):
+        count = 0 #index came from a different chain
+    while count > 0:
+        check_heights = list(range(header_index_start + max(0, count - check_size), header_index_start + count))
+        node_hashes = Ask_Node_Batch([['getblockhash', h] for h in check_heights])
+        matches = [h for h, node_hash in zip(check_heights, node_hashes) if header_index_hash(h) == node_hash]
+        if matches:
+            count = matches[-1] - header_index_start + 1
+            break
+        count = check_heights[0] - header_index_start
+        check_size = rpc_batch_size
+    if count < len(header_index_times):
+        truncate_header_index(count)
+    
+    #add the new headers in batches, saving each batch as it arrives
+    next_height = header_index_start + count
+    if last_height - next_height >= rpc_batch_size:
+        print("\nUpdating the block header index, this is only slow the first time...",flush=True)
+    with open(header_index_path, "ab") as f:
+        for batch_start in range(next_height, last_height + 1, rpc_batch_size):
+            batch_heights = list(range(batch_start, min(batch_start + rpc_batch_size, last_height + 1)))
+            times, hashes = ask_node_block_times(batch_heights)
+            records = bytearray()
+            for height, block_hash, block_time in zip(batch_heights, hashes, times):
+                records += header_index_record.pack(height, bytes.fromhex(block_hash), block_time)
+                header_index_hashes.extend(bytes.fromhex(block_hash))
+                header_index_times.append(block_time)
+            f.write(records)
+            f.flush()
+
+#shortcut for getting the block time and hash from the block number
+def get_block_time(height):
+    k = height - header_index_start
+    if 0 <= k < len(header_index_times):
+        return(header_index_times[k], header_index_hash(height))
+    block_hash = get_block_hash(height)
+    block_header = get_block_header(block_hash)
+    return(block_header['time'], block_hash)
+
+#shortcut for getting the times and hashes of many blocks, asking the node only
+#about blocks that aren't in the header index
+def get_block_times(heights):
+    missing = [h for h in heights if not 0 <= h - header_index_start < len(header_index_times)]
+    missing_times, missing_hashes = ask_node_block_times(missing)
+    from_node = dict(zip(missing, zip(missing_times, missing_hashes)))
+    times = []
+    hashes = []
+    for h in heights:
+        if h in from_node:
+            block_time, block_hash = from_node[h]
+        else:
+            block_time, block_hash = get_block_time(h)
+        times.append(block_time)
+        hashes.append(block_hash)
+    return(times, hashes)
+
 
 #get current block height from local node and exit if connection not made
 print("20%..", end="",flush=True)
 Ask_Node(['getblockcount'], True) #create RPC creds if necessary
-block_count_b = Ask_Node(['getblockcount'], False)
+block_count = get_block_count()
 print("40%..", end="",flush=True)
-block_count = int(block_count_b)             #convert text to integer
 block_count_consensus = block_count-6
 
-#get block header from current block height
-#block_hash = Ask_Node(['getblockhash', str(block_count_consensus)]).decode().strip()
-block_hash = Ask_Node(['getblockhash',block_count_consensus], False).decode().strip()
+#load the header index and bring it up to date with the node
+if use_cache:
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        load_header_index()
+        update_header_index(block_count_consensus)
+    except OSError as e:
+        print("\nCould not save the block header index in "+cache_dir+", continuing without it.")
+        print("Details:", e)
 print("60%..", end="",flush=True)
-block_header_b = Ask_Node(['getblockheader', block_hash, True], False)
-block_header = json.loads(block_header_b)
+
+#get block time from current block height
+latest_time_in_seconds, block_hash = get_block_time(block_count_consensus)
 print("80%..", end="",flush=True)
 
 
@@ -343,7 +703,6 @@ from datetime import datetime, timezone, timedelta
 
 
 #get the date and time of the current block height
-latest_time_in_seconds = block_header['time']
 time_datetime = datetime.fromtimestamp(latest_time_in_seconds,tz=timezone.utc)
 
 #get the date/time of utc midnight on the latest day
@@ -404,6 +763,42 @@ if date_mode:
     price_date_dash = datetime_entered.strftime("%Y-%m-%d")
     
 
+# If backfilling, check both dates and list the midnights of every day between them
+if backfill_mode:
+    
+    #read the start and end dates
+    try:
+        backfill_first_day = datetime.strptime(backfill_start, "%Y/%m/%d").replace(tzinfo=timezone.utc)
+        backfill_last_day = datetime.strptime(backfill_end, "%Y/%m/%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        print("\nError interpreting backfill dates. Please try again. Make sure format is YYYY/MM/DD")
+        sys.exit()
+    
+    #make sure the dates are in order and after the min date
+    dec_15_2023 = datetime(2023,12,15,0,0,0,tzinfo=timezone.utc)
+    if backfill_first_day.timestamp() < dec_15_2023.timestamp():
+        print("\nThe backfill start date is before 2023-12-15, please try again")
+        sys.exit()
+    if backfill_first_day.timestamp() > backfill_last_day.timestamp():
+        print("\nThe backfill start date is after the end date, please try again")
+        sys.exit()
+    
+    #stop at the latest day that has 6 blocks after its last UTC midnight
+    if backfill_last_day.timestamp() >= latest_utc_midnight.timestamp():
+        backfill_last_day = latest_utc_midnight + timedelta(days=-1)
+        print("\nBackfilling up to "+backfill_last_day.strftime("%Y-%m-%d")+", the latest day with a price",flush=True)
+        if backfill_first_day.timestamp() > backfill_last_day.timestamp():
+            print("The backfill start date is after the latest day with a price, please try again")
+            sys.exit()
+    
+    #list the seconds of every utc midnight starting a day
+    backfill_days = []
+    day_seconds = int(backfill_first_day.timestamp())
+    while day_seconds <= backfill_last_day.timestamp():
+        backfill_days.append(day_seconds)
+        day_seconds += seconds_in_a_day
+    
+
 
 
 
@@ -420,32 +815,82 @@ if date_mode:
 
 # The task is simpler when running in block mode (-rb), where we determine the 
 # needed blocks by subtracting 144 from the most recent block height. In date mode, 
-# however, the process is more involved, as we must enter a guess-and-check loop 
-# to determine which blocks correspond to the desired calendar day.
-
-# Since blocks are mined roughly every ten minutes, we can use that as a guideline. 
-# When a user enters a date, we first estimate how many blocks ago that date 
-# occurred. We then check block timestamps starting from our estimate, moving 
-# forward to find the last block of that day, and backward to find the first block.
+# however, the process is more involved, as we must search for the blocks that 
+# correspond to the desired calendar day.
+
+# A day starts with the first block stamped at or after its midnight, and ends right 
+# before the first block stamped at or after the next midnight. A block stamped exactly 
+# at midnight belongs to the new day. Block times are set by miners and don't always go 
+# up from one block to the next, so a block stamped before midnight can come after the 
+# first block of the day. It's still counted in the day it comes in, so every block 
+# belongs to exactly one day.
+
+# Because block times jump around, we can't simply search them. However, the middle 
+# time of a block and the 10 blocks before it (its median time past) never goes down, 
+# and every block must have a time later than the median time past of the block before 
+# it. We use this to search by halves: check the block in the middle of the possible 
+# range, keep the half that contains midnight, and repeat. About 20 checks narrow a 
+# million blocks down to the first block whose median time past is at or after 
+# midnight. Every block after it is stamped after midnight, so the first block of the 
+# day is at or before it. Nodes don't accept blocks stamped more than 2 hours ahead of 
+# their clock, so we look for the first block stamped at or after midnight among the 
+# blocks whose median time past is less than 6 hours before midnight, which leaves 
+# plenty of room for slow blocks.
 
 # Once we’ve identified all the relevant block heights, we store the hashes of each 
 # block in a list so that we can retrieve them one by one in the next step.
 
+# When backfilling many days (--backfill), the midnight that ends one day also starts 
+# the next, so we walk through the days in order and search for each midnight only 
+# once, starting from the block found for the midnight before it.
+
+# Block times and hashes are read from the header index made in step 2. For the few 
+# newest blocks that aren't in the index yet, we don't ask the node about them one at 
+# a time. Instead we send many getblockhash commands in one request, and then many 
+# getblockheader commands in a second request (a JSON-RPC batch).
 
 
-#define a shortcut for getting the block time from the block number
-def get_block_time(height):
-    block_hash_b = Ask_Node(['getblockhash',height], False)
-    #block_header_b = Ask_Node(['getblockheader',block_hash_b[:64],True])
-    block_header_b = Ask_Node(['getblockheader', block_hash_b.decode().strip(), True], False)
 
-    block_header = json.loads(block_header_b)
-    return(block_header['time'], block_hash_b[:64].decode())
+#define a shortcut for getting the median time past of a block
+def get_median_time_past(height):
+    times, hashes = get_block_times(list(range(height-10, height+1)))
+    return(sorted(times)[5])
 
-#define a shortcut for getting the day of money from a time in seconds
-def get_day_of_month(time_in_seconds):
-    time_datetime = datetime.fromtimestamp(time_in_seconds,tz=timezone.utc)
-    return(int(time_datetime.strftime("%d")))
+#define a shortcut for searching by halves between two heights for the first block whose
+#median time past is at or after a time, printing the progress of the search if asked
+def find_first_median_time_at(time_in_seconds, low_height, high_height, show_progress=False):
+    search_steps = max(1, (high_height - low_height).bit_length())
+    steps_done = 0
+    print_every = 20
+    while low_height < high_height:
+        middle_height = (low_height + high_height) // 2
+        if get_median_time_past(middle_height) >= time_in_seconds:
+            high_height = middle_height
+        else:
+            low_height = middle_height + 1
+        
+        #print update, each step halves the blocks left to search
+        steps_done += 1
+        while show_progress and steps_done/search_steps*100 >= print_every and print_every < 100:
+            print(str(print_every)+"%..",end="",flush=True)
+            print_every += 20
+    return(low_height)
+
+#define a shortcut for finding the first block stamped at or after a time, searching
+#between two heights
+def find_first_block_after(time_in_seconds, low_height, high_height, show_progress=False):
+    
+    #every block after this one is stamped after the time
+    last_height = find_first_median_time_at(time_in_seconds, low_height, high_height, show_progress)
+    
+    #a block stamped at or after the time can come earlier, but not among blocks with a 
+    #median time past more than 6 hours before it
+    first_height = find_first_median_time_at(time_in_seconds - 6*60*60, low_height, last_height)
+    block_times, block_hashes = get_block_times(list(range(first_height, last_height + 1)))
+    for k in range(len(block_times)):
+        if block_times[k] >= time_in_seconds:
+            return(first_height + k)
+    return(last_height + 1)
 
 #if block mode add the blocks and hashes to a list
 if block_mode:
@@ -456,9 +901,11 @@ if block_mode:
     block_finish_num = block_count
     block_start_num = block_finish_num - 144
     
+    #get the times and hashes of all the blocks in a few batch requests
+    batch_times, batch_hashes = get_block_times(list(range(block_start_num, block_finish_num)))
+    
     #append needed block nums and hashes needed
     block_num = block_start_num
-    time_in_seconds, hash_end = get_block_time(block_start_num)
     print_every = 0
     while block_num < block_finish_num:
         
@@ -467,10 +914,9 @@ if block_mode:
             print(str(print_every)+"%..",end="",flush=True)
             print_every += 20
         block_nums_needed.append(block_num)
-        block_hashes_needed.append(hash_end)
-        block_times_needed.append(time_in_seconds)
+        block_hashes_needed.append(batch_hashes[block_num-block_start_num])
+        block_times_needed.append(batch_times[block_num-block_start_num])
         block_num += 1
-        time_in_seconds, hash_end = get_block_time(block_num)
         
     print("100%\t\t\t25% done",flush=True)
 
@@ -479,102 +925,19 @@ elif date_mode:
     
     print("\nFinding first blocks on "+datetime_entered.strftime("%b %d, %Y"),flush=True)
     print("0%..",end="", flush=True)
-    #first estimate of the block height of the price day
-    seconds_since_price_day = latest_time_in_seconds - price_day_seconds
-    blocks_ago_estimate = round(144*float(seconds_since_price_day)/float(seconds_in_a_day))
-    price_day_block_estimate = block_count_consensus - blocks_ago_estimate
-    
-    #check the time of the price day block estimate
-    time_in_seconds, hash_end = get_block_time(price_day_block_estimate) 
-    
-    #get new block estimate from the seconds difference using 144 blocks per day
-    print("20%..",end="",flush=True)
-    seconds_difference = time_in_seconds - price_day_seconds
-    block_jump_estimate = round(144*float(seconds_difference)/float(seconds_in_a_day))
-    
-    #iterate above process until it oscillates around the correct block
-    last_estimate = 0
-    last_last_estimate = 0
-    
-    print("40%..",end="",flush=True)
-    while block_jump_estimate >6 and block_jump_estimate != last_last_estimate:
-        
-        #when we oscillate around the correct block, last_last_estimate = block_jump_estimate
-        last_last_estimate = last_estimate
-        last_estimate = block_jump_estimate
-        
-        #get block header or new estimate
-        price_day_block_estimate = price_day_block_estimate-block_jump_estimate
-        
-        #check time of new block and get new block jump estimate
-        time_in_seconds, hash_end = get_block_time(price_day_block_estimate) 
-        seconds_difference = time_in_seconds - price_day_seconds
-        block_jump_estimate = round(144*float(seconds_difference)/float(seconds_in_a_day))
-    
-    print("60%..",end="",flush=True)
-    #the oscillation may be over multiple blocks so we add/subtract single blocks 
-    #to ensure we have exactly the first block of the target day
-    if time_in_seconds > price_day_seconds:
-        
-        # if the estimate was after price day look at earlier blocks
-        while time_in_seconds > price_day_seconds:
-            
-            #decrement the block by one, read new block header, check time
-            price_day_block_estimate = price_day_block_estimate-1
-            time_in_seconds, hash_end = get_block_time(price_day_block_estimate) 
-            
-        #the guess is now perfectly the first block before midnight
-        price_day_block_estimate = price_day_block_estimate + 1
-        
-    # if the estimate was before price day look for later blocks
-    elif time_in_seconds < price_day_seconds:
-        
-        while time_in_seconds < price_day_seconds:
-            
-            #increment the block by one, read new block header, check time
-            price_day_block_estimate = price_day_block_estimate+1
-            time_in_seconds, hash_end = get_block_time(price_day_block_estimate) 
-    
-    print("80%..",end="",flush=True)
-    #assign the estimate as the price day block since it is correct now    
-    price_day_block = price_day_block_estimate
-    
-    #get the day of the month 
-    time_in_seconds, hash_start = get_block_time(price_day_block)
-    day1 = get_day_of_month(time_in_seconds)
-    
-    #get the last block number of the day
-    price_day_block_end = price_day_block 
-    time_in_seconds, hash_end = get_block_time(price_day_block_end)
-    day2 = get_day_of_month(time_in_seconds)
     
+    #search for the first block after midnight at the start of the price day
+    price_day_block = find_first_block_after(price_day_seconds, header_index_start, block_count, True)
     print("100%\t\t\t25% done",flush=True)
     print("\nFinding last blocks on "+datetime_entered.strftime("%b %d, %Y"),flush=True)
+    print("0%..",end="", flush=True)
+    
+    #search for the first block after midnight at the end of the price day
+    price_day_block_end = find_first_block_after(price_day_seconds + seconds_in_a_day, price_day_block, block_count, True)
     
     #load block nums and hashes needed
-    block_num = 0
-    print_next = 0
-    while day1 == day2:
-        
-        #print progress update
-        block_num+=1
-        if block_num/144 * 100 > print_next:
-            if print_next < 100:
-                print(str(print_next)+"%..",end="",flush=True)
-                print_next +=20
-        
-        #append needed block
-        block_nums_needed.append(price_day_block_end)
-        block_hashes_needed.append(hash_end)
-        block_times_needed.append(time_in_seconds)
-        price_day_block_end += 1 #assume 30+ blocks this day
-        time_in_seconds, hash_end = get_block_time(price_day_block_end)
-        day2 = get_day_of_month(time_in_seconds)
-    
-    #complete print update status
-    while print_next<100:
-        print(str(print_next)+"%..",end="",flush=True)
-        print_next +=20
+    block_nums_needed = list(range(price_day_block, price_day_block_end))
+    block_times_needed, block_hashes_needed = get_block_times(block_nums_needed)
     
     #set start and end block numbers
     block_start_num = price_day_block
@@ -582,6 +945,29 @@ elif date_mode:
 
     print("100%\t\t\t50% done",flush=True)
 
+#if backfilling find the first and last blocks of every day
+elif backfill_mode:
+    
+    print("\nFinding the blocks of "+str(len(backfill_days))+" days",flush=True)
+    print("0%..",end="", flush=True)
+    
+    #each day ends where the next day starts, so every midnight is searched for once
+    #and each search starts from the block found for the midnight before it
+    backfill_day_blocks = []
+    day_start_block = find_first_block_after(backfill_days[0], header_index_start, block_count)
+    print_every = 20
+    for k in range(len(backfill_days)):
+        day_end_block = find_first_block_after(backfill_days[k] + seconds_in_a_day, day_start_block, block_count)
+        backfill_day_blocks.append((backfill_days[k], day_start_block, day_end_block))
+        day_start_block = day_end_block
+        
+        #print update
+        if (k+1)/len(backfill_days)*100 >= print_every and print_every < 100:
+            print(str(print_every)+"%..",end="",flush=True)
+            print_every += 20
+    
+    print("100%\t\t\t25% done",flush=True)
+
 
 
 
@@ -634,6 +1020,18 @@ for exponent in range(-6,6): #python range uses 'less than' for the big number
         bin_value = 10 ** (exponent + b/200)
         output_histogram_bins.append(bin_value)
 
+# Create a list of the bin edges in sats. An edge is the smallest whole number of sats
+# whose btc amount is not below the bin value, so a sat amount falls in the same bin
+# as its btc amount and can be placed with a binary search (bisect) on the list
+output_histogram_bin_sats = []
+for bin_value in output_histogram_bins:
+    edge_sats = int(bin_value * 1e8)
+    while edge_sats > 0 and (edge_sats - 1) / 1e8 >= bin_value:
+        edge_sats -= 1
+    while edge_sats / 1e8 < bin_value:
+        edge_sats += 1
+    output_histogram_bin_sats.append(edge_sats)
+
 # Create a list the same size as the bell curve to keep the count of the bins
 number_of_bins = len(output_histogram_bins)
 output_histogram_bin_counts = []
@@ -657,8 +1055,60 @@ for n in range(0,number_of_bins):
 
 # To improve efficiency, we request the raw binary block data and manually convert it 
 # into integers and strings. This requires defining functions that translate binary data 
-# into integers, such as read_varint and encode_varint. We also compute the txid 
-# manually, since binary Bitcoin blocks do not store it directly.
+# into integers, such as read_varint. We also compute the txid manually, since binary 
+# Bitcoin blocks do not store it directly.
+
+# The block is read in place: instead of copying each field out of the block, we keep 
+# a position (an offset in bytes) and read numbers directly at that position. Parts 
+# that we only need to skip, such as scripts and witness data, are never copied; we 
+# just read their length and move the position past them. The txid is the double 
+# sha256 hash of the transaction without its witness data, so while reading we note 
+# where the witness data starts and hash the parts around it straight from the block.
+
+# To find same day inputs, we keep every txid of the day in a set. Each input names 
+# the txid it spends as a raw 32 byte hash, so we can look it up in the set directly 
+# from the block without converting anything to text.
+
+# Each block is read by the parse_block function, which returns the block's txids and 
+# the transactions that passed every filter except same day inputs from earlier blocks. 
+# Because it needs nothing from other blocks, several blocks can be parsed at once on 
+# separate processes (the --workers option, on Linux) to use more of the computer's 
+# cores. Each process downloads its blocks itself and sends back only what it kept, 
+# so whole blocks never pass through the main process. The results are then combined one block at a time in block order, checking 
+# each transaction's inputs against the txids of the earlier blocks, exactly as if all 
+# blocks had been read one after another.
+
+# The fastest way to get a raw block from the node is its REST interface (rest=1 in 
+# bitcoin.conf), which sends the block as binary. The RPC interface sends the block 
+# as hex text, which is twice the size and has to be converted back to binary. We try 
+# REST first. If the node refuses the first REST request (403 or 404), REST is turned 
+# off and we use RPC for the rest of the run. Any other failure, like a busy node or 
+# a block REST can't find, only gets that one block through RPC.
+
+# Downloading a block and reading its transactions are done at the same time. While 
+# one block is being read, a few helper threads are already downloading the next 
+# blocks, so neither the node nor the parser has to wait for the other. The blocks 
+# are still handed to the parser in order, which matters for the same day inputs filter.
+
+# What the parser keeps from a block (its txids and the transactions that passed the 
+# filters) is a small fraction of the block, so it's saved in the cache folder under 
+# the block's hash. Running the same day again, or a block window that overlaps an 
+# earlier one, reads those blocks from the saved files instead of downloading and 
+# parsing them. Each file is stamped with the parser version, so files saved by a 
+# parser that kept different data are parsed again, and the least recently used files 
+# are removed when the saved blocks take up more than --cache-size megabytes. A saved 
+# block is about 150 KB, and with the day's saved sum (below) a day takes about 25 MB, 
+# so the default 2000 MB keeps about 80 days. A longer backfill still works, but only 
+# its last 80 days are saved for the next run.
+
+# The parser also counts the outputs it keeps into a small histogram for the block, 
+# which is saved with it. The histogram of any range of blocks is then the sum of the 
+# block histograms, minus the outputs of transactions that spend a txid from an 
+# earlier block of the range. That last part depends on where the range starts, so the 
+# finished histogram and the outputs that are left are saved as well, under the first 
+# and last block hash of the range. Running the same day again reads that one file 
+# instead of every block. A -rb window moves with every new block, so it's summed from 
+# the saved blocks each time and its sum isn't saved.
 
 # After defining these functions, we loop through the list of required block hashes 
 # and extract transaction output amounts to place into histogram bins. We apply 
@@ -671,219 +1121,523 @@ for n in range(0,number_of_bins):
 # histogram bin according to the bitcoin amount of the output.
 
 
-print("\nLoading every transaction from every block",flush=True)
+#backfilling loads the blocks of each day in step 14 instead
+if not backfill_mode:
+    print("\nLoading every transaction from every block",flush=True)
 
 
 
 # #initialize output lists and variables
-from struct import unpack
+from struct import unpack_from
 import binascii
-todays_txids = set()
-raw_outputs = []
-block_heights_dec = []
-block_times_dec = []
-print_next = 0
-block_num = 0
+coinbase_txid = b'\x00' * 32
+coinbase_index = b'\xff\xff\xff\xff'
+raw_outputs = array('Q')    #output amounts in sats, one after another
+raw_output_blocks = []      #(first output, end output, height, time) of each block's outputs
+daemon_first_blocks = []    #parsed blocks kept for following new blocks
 
 
-#shortcut for reading bytes of data from the block file
-import struct
-from math import log10 
+#shortcut for reading a variable size integer at a position in the block, returning
+#the integer and the position right after it
+from bisect import bisect_right
 import hashlib
-def read_varint(f):
-    i = f.read(1)
-    if not i:
-        return 0
-    i = i[0]
+def read_varint(data, pos):
+    i = data[pos]
     if i < 0xfd:
-        return i
+        return i, pos + 1
     elif i == 0xfd:
-        val = struct.unpack("<H", f.read(2))[0]
+        return unpack_from("<H", data, pos + 1)[0], pos + 3
     elif i == 0xfe:
-        val = struct.unpack("<I", f.read(4))[0]
-    else:
-        val = struct.unpack("<Q", f.read(8))[0]
-    return val
-
-#shortcut for encoding variable size integers to bytes
-from io import BytesIO
-def encode_varint(i: int) -> bytes:
-    assert i >= 0
-    if i < 0xfd:
-        return i.to_bytes(1, 'little')
-    elif i <= 0xffff:
-        return b'\xfd' + i.to_bytes(2, 'little')
-    elif i <= 0xffffffff:
-        return b'\xfe' + i.to_bytes(4, 'little')
+        return unpack_from("<I", data, pos + 1)[0], pos + 5
     else:
-        return b'\xff' + i.to_bytes(8, 'little')
+        return unpack_from("<Q", data, pos + 1)[0], pos + 9
 
-#shortcut for computing the txid because blk files don't store txids
-def compute_txid(raw_tx_bytes: bytes) -> bytes:
+#shortcut for getting the raw bytes of a block from the node
+rest_available = use_rest
+rest_has_worked = False
+def get_raw_block(block_hash):
+    global rest_available, rest_has_worked
+    
+    # Get raw block bytes using REST if the node allows it
+    if rest_available:
+        try:
+            status, reason, raw_block_bytes = rpc_request("GET", f"/rest/block/{block_hash}.bin", None, {})
+        except (http.client.HTTPException, OSError):
+            status = None
+        if status == 200:
+            rest_has_worked = True
+            return raw_block_bytes
+        
+        # a node with REST turned off refuses the very first request
+        if status in (403, 404) and not rest_has_worked:
+            rest_available = False
     
-    stream = BytesIO(raw_tx_bytes)
-
-    # Read version
-    version = stream.read(4)
-
-    # Peek at marker/flag to detect SegWit
-    marker = stream.read(1)
-    flag = stream.read(1)
-    is_segwit = (marker == b'\x00' and flag == b'\x01')
-
-    if not is_segwit:
-        # Legacy tx: rewind and hash full raw tx
-        stream.seek(0)
-        stripped_tx = stream.read()
-    else:
-        # Start stripped tx with version
-        stripped_tx = bytearray()
-        stripped_tx += version
-
-        # Inputs
-        input_count = read_varint(stream)
-        stripped_tx += encode_varint(input_count)
-        for _ in range(input_count):
-            stripped_tx += stream.read(32)  # prev txid
-            stripped_tx += stream.read(4)   # vout index
-            script_len = read_varint(stream)
-            stripped_tx += encode_varint(script_len)
-            stripped_tx += stream.read(script_len)
-            stripped_tx += stream.read(4)   # sequence
-
-        # Outputs
-        output_count = read_varint(stream)
-        stripped_tx += encode_varint(output_count)
-        for _ in range(output_count):
-            stripped_tx += stream.read(8)   # value
-            script_len = read_varint(stream)
-            stripped_tx += encode_varint(script_len)
-            stripped_tx += stream.read(script_len)
-
-        # Skip witness data
-        for _ in range(input_count):
-            stack_count = read_varint(stream)
-            for _ in range(stack_count):
-                item_len = read_varint(stream)
-                stream.read(item_len)
-
-        # Locktime
-        stripped_tx += stream.read(4)
-
-    return hashlib.sha256(hashlib.sha256(stripped_tx).digest()).digest()[::-1]
-
-
-# read in all blocks needed
-for bh in block_hashes_needed:
-    block_num += 1
-    print_progress = block_num / len(block_hashes_needed) * 100
-    if print_progress > print_next and print_next < 100:
-        #print(f"{int(print_next)}% ", end="", flush=True)
-        print(f"{int(print_next)}%..",end="",flush=True)
-        print_next += 1
-        if print_next % 7 == 0:
-            print("\n", end="")
-
     # Get raw block hex using RPC
-    raw_block_hex = Ask_Node(["getblock", bh, 0], False).decode().strip()
-    raw_block_bytes = binascii.unhexlify(raw_block_hex)
-    stream = BytesIO(raw_block_bytes)
+    raw_block_hex = Ask_Node(["getblock", block_hash, 0], False)
+    return binascii.unhexlify(raw_block_hex)
+
+#shortcut for downloading blocks ahead of the parser and returning them in order, with
+#at most prefetch_depth downloads asked for and not yet handed to the parser
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+def prefetch_raw_blocks(block_hashes):
+    with ThreadPoolExecutor(max_workers=prefetch_depth) as fetchers:
+        pending = deque()
+        for block_hash in block_hashes:
+            pending.append(fetchers.submit(get_raw_block, block_hash))
+            if len(pending) >= prefetch_depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+#shortcut for reading all the transactions of one block. Returns the txids of the block,
+#for each transaction that passes the filters the txids its inputs spend and its output
+#amounts in sats, and the block's histogram as (bin number, count) pairs of those outputs
+def parse_block(raw_block_bytes):
+    block = raw_block_bytes
+    block_view = memoryview(raw_block_bytes)
+    block_txids = []
+    block_txids_set = set()
+    candidates = []
 
     # Read header (skip 80 bytes)
-    stream.read(80)
-    tx_count = read_varint(stream)
+    tx_count, pos = read_varint(block, 80)
     
     # loop through all txs in this block
-    txs_to_add = []
     for tx_index in range(tx_count):
-        start_tx = stream.tell()
-        version = stream.read(4)
+        start_tx = pos
 
         # Check for SegWit
-        marker_flag = stream.read(2)
-        is_segwit = marker_flag == b'\x00\x01'
-        if not is_segwit:
-            stream.seek(start_tx + 4)
-
-        # Read inputs
-        input_count = read_varint(stream)
-        inputs = []
+        is_segwit = block[pos+4] == 0 and block[pos+5] == 1
+        if is_segwit:
+            pos += 6
+        else:
+            pos += 4
+
+        # Read inputs. A tx with more than 5 inputs can never pass the filter, so only
+        # its offsets are advanced, the txid is still needed for the same day check
+        input_count, pos = read_varint(block, pos)
+        is_candidate = input_count <= 5
         has_op_return = False
         witness_exceeds = False
         is_coinbase = False
-        input_txids = []
+        is_same_day_tx = False
+        spent_txids = []
         for _ in range(input_count):
-            prev_txid = stream.read(32)
-            prev_index = stream.read(4)
-            script_len = read_varint(stream)
-            script = stream.read(script_len)
-            stream.read(4)
-            input_txids.append(prev_txid[::-1].hex())
-            if prev_txid == b'\x00' * 32 and prev_index == b'\xff\xff\xff\xff':
-                is_coinbase = True
-            inputs.append({"script": script})
-
-        #read outputs
-        output_count = read_varint(stream)
+            
+            if is_candidate:
+                #check same day tx within this block, the txid this input spends is the first 32 bytes
+                spent_txid = block[pos:pos+32]
+                if spent_txid in block_txids_set:
+                    is_same_day_tx = True
+                spent_txids.append(spent_txid)
+                if block.startswith(coinbase_txid, pos) and block.startswith(coinbase_index, pos+32):
+                    is_coinbase = True
+            
+            #skip the prevout, script and sequence (most lengths fit in one byte)
+            script_len = block[pos+36]
+            if script_len < 0xfd:
+                pos += 37 + script_len + 4
+            else:
+                script_len, pos = read_varint(block, pos+36)
+                pos += script_len + 4
+
+        #read outputs, only reading amounts and scripts of txs with exactly 2 outputs
+        output_count, pos = read_varint(block, pos)
+        is_candidate = is_candidate and output_count == 2
         output_values = []
         for _ in range(output_count):
-            value_sats = unpack("<Q", stream.read(8))[0]
-            script_len = read_varint(stream)
-            script = stream.read(script_len)
-            if script and script[0] == 0x6a:
-                has_op_return = True
-            value_btc = value_sats / 1e8
-            if 1e-5 < value_btc < 1e5:
-                output_values.append(value_btc)
-
-        # check witness data
+            script_len = block[pos+8]
+            if script_len < 0xfd:
+                script_pos = pos + 9
+            else:
+                script_len, script_pos = read_varint(block, pos+8)
+            if is_candidate:
+                if script_len and block[script_pos] == 0x6a:
+                    has_op_return = True
+                value_sats = unpack_from("<Q", block, pos)[0]
+                if 1000 < value_sats < 10000000000000:
+                    output_values.append(value_sats)
+            pos = script_pos + script_len
+        end_outputs = pos
+
+        # check witness data, or only skip it for txs that already failed the filter
         if is_segwit:
-            for input_data in inputs:
-                stack_count = read_varint(stream)
+            for _ in range(input_count):
+                stack_count, pos = read_varint(block, pos)
                 total_witness_len = 0
                 for _ in range(stack_count):
-                    item_len = read_varint(stream)
-                    total_witness_len += item_len
-                    stream.read(item_len)
-                    if item_len > 500 or total_witness_len > 500:
-                        witness_exceeds = True
-
-        #comput txid
-        stream.read(4)
-        end_tx = stream.tell()
-        stream.seek(start_tx)
-        raw_tx = stream.read(end_tx - start_tx)
-        txid = compute_txid(raw_tx)
-        todays_txids.add(txid.hex())
-
-        #check same day tx
-        is_same_day_tx = any(itxid in todays_txids for itxid in input_txids)
-
-        # apply filter and add output to bell curve
-        if (input_count <= 5 and output_count == 2 and not is_coinbase and
-            not has_op_return and not witness_exceeds and not is_same_day_tx):
-            for amount in output_values:
-                amount_log = log10(amount)
-                percent_in_range = (amount_log - first_bin_value) / range_bin_values
-                bin_number_est = int(percent_in_range * number_of_bins)
-                while output_histogram_bins[bin_number_est] <= amount:
-                    bin_number_est += 1
-                bin_number = bin_number_est - 1
-                output_histogram_bin_counts[bin_number] += 1.0
-                txs_to_add.append(amount)
-
-    # add outputs to raw outputs
-    if len(txs_to_add) > 0:
-        bkh = block_nums_needed[block_num - 1]
-        tm = block_times_needed[block_num - 1]
-        for amt in txs_to_add:
-            raw_outputs.append(amt)
-            block_heights_dec.append(bkh)
-            block_times_dec.append(tm)
-
-
-print("100%",flush=True)
-print("\t\t\t\t\t\t95% done",flush=True)
+                    item_len = block[pos]
+                    if item_len < 0xfd:
+                        pos += 1 + item_len
+                    else:
+                        item_len, pos = read_varint(block, pos)
+                        pos += item_len
+                    if is_candidate:
+                        total_witness_len += item_len
+                        if item_len > 500 or total_witness_len > 500:
+                            witness_exceeds = True
+
+        #comput txid by hashing the tx without the segwit marker, flag and witness data
+        pos += 4
+        if is_segwit:
+            tx_hash = hashlib.sha256(block_view[start_tx:start_tx+4])
+            tx_hash.update(block_view[start_tx+6:end_outputs])
+            tx_hash.update(block_view[pos-4:pos])
+        else:
+            tx_hash = hashlib.sha256(block_view[start_tx:pos])
+        txid = hashlib.sha256(tx_hash.digest()).digest()
+        block_txids.append(txid)
+        block_txids_set.add(txid)
+
+        # apply filter and keep the tx for the check against earlier blocks
+        if (is_candidate and not is_coinbase and not has_op_return and
+            not witness_exceeds and not is_same_day_tx and output_values):
+            candidates.append((spent_txids, output_values))
+
+    # count the outputs of the kept txs in each histogram bin
+    bin_counts = {}
+    for spent_txids, output_values in candidates:
+        for amount_sats in output_values:
+            bin_number = bisect_right(output_histogram_bin_sats, amount_sats) - 1
+            bin_counts[bin_number] = bin_counts.get(bin_number, 0) + 1
+    block_histogram = sorted(bin_counts.items())
+
+    return block_txids, candidates, block_histogram
+
+#shortcut for downloading and parsing one block in a parsing process. A node error ends
+#the program with sys.exit, which would end the process without an answer, so the
+#error is sent back for the main process to end with instead
+def download_and_parse_block(block_hash):
+    try:
+        return parse_block(get_raw_block(block_hash))
+    except SystemExit as e:
+        return e
+
+#shortcut for waiting for a block from a parsing process, ending the program like a
+#node error in the main process would
+def get_parsed_block(result):
+    parsed_block = result.get()
+    if isinstance(parsed_block, SystemExit):
+        raise parsed_block
+    return parsed_block
+
+#shortcut for downloading and parsing blocks, on several processes if requested,
+#returning them in order
+import multiprocessing
+def parse_blocks_in_order(block_hashes):
+    if parse_pool is not None:
+        pending = deque()
+        for block_hash in block_hashes:
+            pending.append(parse_pool.apply_async(download_and_parse_block, (block_hash,)))
+            while len(pending) > 2 * parse_workers:
+                yield get_parsed_block(pending.popleft())
+        while pending:
+            yield get_parsed_block(pending.popleft())
+    else:
+        for raw_block_bytes in prefetch_raw_blocks(block_hashes):
+            yield parse_block(raw_block_bytes)
+
+#parsing on several processes copies this program's memory to them (fork). Only Linux
+#forks safely once the program has open connections, so other systems use one process
+if parse_workers > 1 and system != "Linux":
+    print("\n--workers is only supported on Linux, parsing on one process",flush=True)
+    parse_workers = 1
+
+#start the parsing processes once, before any download threads, and use them for every
+#block of the run. Backfilling uses its processes for whole days instead
+parse_pool = None
+if parse_workers > 1 and not backfill_mode:
+    parse_pool = multiprocessing.get_context("fork").Pool(parse_workers, initializer=forget_parent_connections)
+
+# A parsed block file starts with a header (file type, file format, parser version, 
+# number of txids, number of transactions kept, number of histogram bins and the size 
+# of the file) followed by the txids, then for each transaction kept the number of 
+# spent txids and outputs, the spent txids and the output amounts in sats, and last 
+# the bin number and count of each histogram bin used. Change parser_version whenever 
+# parse_block changes what it keeps.
+block_cache_dir = os.path.join(cache_dir, "blocks")
+block_cache_header = struct.Struct("<4sHHIIII")
+block_cache_bin = struct.Struct("<HI")
+block_cache_format = 4
+parser_version = 3
+block_cache_available = use_cache
+
+#shortcut for the file name of a parsed block
+def block_cache_path(block_hash):
+    return os.path.join(block_cache_dir, block_hash + ".dat")
+
+#check that a parsed block file exists, is complete and was saved by this parser
+def block_cache_has(block_hash):
+    try:
+        with open(block_cache_path(block_hash), "rb") as f:
+            header = f.read(block_cache_header.size)
+            file_size = os.fstat(f.fileno()).st_size
+    except OSError:
+        return False
+    if len(header) < block_cache_header.size:
+        return False
+    file_type, file_format, version, txid_count, candidate_count, bin_count, record_size = block_cache_header.unpack(header)
+    return (file_type == b"UTXO" and file_format == block_cache_format and 
+            version == parser_version and record_size == file_size)
+
+#read a parsed block file and mark it as recently used
+def read_block_cache(block_hash):
+    path = block_cache_path(block_hash)
+    with open(path, "rb") as f:
+        data = f.read()
+    os.utime(path)
+    txid_count, candidate_count, bin_count = block_cache_header.unpack_from(data, 0)[3:6]
+    pos = block_cache_header.size
+    block_txids = [data[p:p+32] for p in range(pos, pos + 32*txid_count, 32)]
+    pos += 32*txid_count
+    candidates = []
+    for _ in range(candidate_count):
+        spent_count = data[pos]
+        output_count = data[pos+1]
+        pos += 2
+        spent_txids = [data[p:p+32] for p in range(pos, pos + 32*spent_count, 32)]
+        pos += 32*spent_count
+        output_values = list(unpack_from(f"<{output_count}Q", data, pos))
+        pos += 8*output_count
+        candidates.append((spent_txids, output_values))
+    block_histogram = list(block_cache_bin.iter_unpack(data[pos:pos + block_cache_bin.size*bin_count]))
+    return block_txids, candidates, block_histogram
+
+#save a parsed block file
+def save_block_cache(block_hash, block_txids, candidates, block_histogram):
+    record = bytearray()
+    record += b"".join(block_txids)
+    for spent_txids, output_values in candidates:
+        record += bytes([len(spent_txids), len(output_values)])
+        record += b"".join(spent_txids)
+        record += struct.pack(f"<{len(output_values)}Q", *output_values)
+    for bin_number, bin_count in block_histogram:
+        record += block_cache_bin.pack(bin_number, bin_count)
+    header = block_cache_header.pack(b"UTXO", block_cache_format, parser_version, 
+        len(block_txids), len(candidates), len(block_histogram), block_cache_header.size + len(record))
+    write_cache_file(block_cache_path(block_hash), header, record)
+
+#write a saved file to a temporary file first, so that a half written file is never read
+def write_cache_file(path, header, record):
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(header)
+            f.write(record)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+# A block range file has the same header as a parsed block file, with the number of 
+# histogram bins used, outputs and blocks with outputs in place of the numbers of txids, 
+# transactions kept and bins. It's followed by the bin number and count of each bin 
+# used, the output amounts in sats, and the first output, end output, height and time 
+# of each block with outputs.
+range_cache_dir = os.path.join(cache_dir, "ranges")
+range_cache_block = struct.Struct("<IIII")
+
+#shortcut for the file name of a block range, named by its first and last block hash
+def range_cache_path(block_hashes):
+    return os.path.join(range_cache_dir, block_hashes[0] + "-" + block_hashes[-1] + ".dat")
+
+#read a block range file and mark it as recently used. Returns None if the range isn't
+#saved, or the file is incomplete or was saved by a different parser
+def read_range_cache(block_hashes):
+    path = range_cache_path(block_hashes)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        file_type, file_format, version, bin_count, output_count, output_block_count, record_size = block_cache_header.unpack_from(data, 0)
+    except (OSError, struct.error):
+        return None
+    if (file_type != b"UTXR" or file_format != block_cache_format or 
+            version != parser_version or record_size != len(data)):
+        return None
+    pos = block_cache_header.size
+    bin_counts = [0.0] * number_of_bins
+    for bin_number, count in block_cache_bin.iter_unpack(data[pos:pos + block_cache_bin.size*bin_count]):
+        bin_counts[bin_number] = float(count)
+    pos += block_cache_bin.size*bin_count
+    outputs = array('Q', data[pos:pos + 8*output_count])
+    if sys.byteorder == "big":
+        outputs.byteswap()
+    pos += 8*output_count
+    output_blocks = list(range_cache_block.iter_unpack(data[pos:pos + range_cache_block.size*output_block_count]))
+    return bin_counts, outputs, output_blocks
+
+#save a block range file
+def save_range_cache(block_hashes, bin_counts, outputs, output_blocks):
+    record = bytearray()
+    bins_used = [(bin_number, int(count)) for bin_number, count in enumerate(bin_counts) if count]
+    for bin_number, count in bins_used:
+        record += block_cache_bin.pack(bin_number, count)
+    output_bytes = array('Q', outputs)
+    if sys.byteorder == "big":
+        output_bytes.byteswap()
+    record += output_bytes.tobytes()
+    for output_block in output_blocks:
+        record += range_cache_block.pack(*output_block)
+    header = block_cache_header.pack(b"UTXR", block_cache_format, parser_version, 
+        len(bins_used), len(outputs), len(output_blocks), block_cache_header.size + len(record))
+    write_cache_file(range_cache_path(block_hashes), header, record)
+
+#remove the least recently used parsed block and block range files until they fit in
+#the size limit, and temporary files left behind by runs that were stopped while saving.
+#A temporary file only exists for a moment, so one older than an hour is left over
+import time
+def trim_block_cache():
+    cache_files = []
+    for folder in (block_cache_dir, range_cache_dir):
+        if not os.path.isdir(folder):
+            continue
+        for entry in os.scandir(folder):
+            if entry.name.endswith(".dat"):
+                file_stat = entry.stat()
+                cache_files.append((file_stat.st_mtime, file_stat.st_size, entry.path))
+            elif entry.name.endswith(".tmp") and entry.stat().st_mtime < time.time() - 3600:
+                os.remove(entry.path)
+    cache_files.sort()
+    total_size = sum(file_size for _, file_size, _ in cache_files)
+    for _, file_size, path in cache_files:
+        if total_size <= block_cache_mb * 1000000:
+            break
+        os.remove(path)
+        total_size -= file_size
+
+#shortcut for getting the parsed blocks in order, reading saved blocks from the cache
+#and downloading and parsing the rest
+def load_blocks_in_order(block_hashes):
+    global block_cache_available
+    
+    #find which blocks are saved
+    cached_hashes = set()
+    if block_cache_available:
+        try:
+            os.makedirs(block_cache_dir, exist_ok=True)
+            cached_hashes = set(h for h in block_hashes if block_cache_has(h))
+        except OSError as e:
+            print("\nCould not save parsed blocks in "+block_cache_dir+", continuing without them.")
+            print("Details:", e)
+            block_cache_available = False
+    
+    #download and parse the blocks that aren't saved
+    parsed_blocks = parse_blocks_in_order([h for h in block_hashes if h not in cached_hashes])
+    for block_hash in block_hashes:
+        
+        #read the block if it's saved and still readable, otherwise parse it
+        is_saved = False
+        if block_hash in cached_hashes:
+            try:
+                parsed_block = read_block_cache(block_hash)
+                is_saved = True
+            except (OSError, struct.error):
+                parsed_block = parse_block(get_raw_block(block_hash))
+        else:
+            parsed_block = next(parsed_blocks)
+        
+        #save the parsed block for next time
+        if block_cache_available and not is_saved:
+            try:
+                save_block_cache(block_hash, *parsed_block)
+            except OSError as e:
+                print("\nCould not save parsed blocks in "+block_cache_dir+", continuing without them.")
+                print("Details:", e)
+                block_cache_available = False
+        yield parsed_block
+    parsed_blocks.close()
+
+
+#shortcut for the histogram and outputs of a range of blocks. Adds up the block
+#histograms, takes back the outputs of txs that spend a txid from an earlier block of
+#the range, and returns the bin counts, the output amounts in sats and the (first
+#output, end output, height, time) of each block's outputs. Each parsed block is also
+#added to kept_blocks if it's given
+def sum_block_range(block_hashes, block_nums, block_times, show_progress=False, kept_blocks=None):
+    bin_counts = [0.0] * number_of_bins
+    range_txids = set()
+    outputs = array('Q')
+    output_blocks = []
+    print_next = 0
+    block_num = 0
+    for block_txids, candidates, block_histogram in load_blocks_in_order(block_hashes):
+        block_num += 1
+        print_progress = block_num / len(block_hashes) * 100
+        if show_progress and print_progress > print_next and print_next < 100:
+            print(f"{int(print_next)}%..",end="",flush=True)
+            print_next += 1
+            if print_next % 7 == 0:
+                print("\n", end="")
+        if kept_blocks is not None:
+            kept_blocks.append((block_txids, candidates, block_histogram))
+
+        # add the block's histogram to the bell curve
+        for bin_number, bin_count in block_histogram:
+            bin_counts[bin_number] += bin_count
+        
+        # take back the outputs of txs that spend a txid from an earlier block of the range
+        txs_to_add = []
+        for spent_txids, output_values in candidates:
+            if any(spent_txid in range_txids for spent_txid in spent_txids):
+                for amount_sats in output_values:
+                    bin_number = bisect_right(output_histogram_bin_sats, amount_sats) - 1
+                    bin_counts[bin_number] -= 1.0
+                continue
+            txs_to_add.extend(output_values)
+        range_txids.update(block_txids)
+
+        # add outputs and keep the block's height and time once for all of them
+        if len(txs_to_add) > 0:
+            first_output = len(outputs)
+            outputs.extend(txs_to_add)
+            output_blocks.append((first_output, len(outputs), block_nums[block_num - 1], block_times[block_num - 1]))
+    return bin_counts, outputs, output_blocks
+
+#shortcut for the histogram and outputs of a range of blocks, read from its block range
+#file if an earlier run saved it, otherwise added up from the blocks and saved
+def load_block_range(block_hashes, block_nums, block_times, show_progress=False):
+    global block_cache_available
+    if block_cache_available and len(block_hashes) > 0:
+        saved_range = read_range_cache(block_hashes)
+        if saved_range is not None:
+            return saved_range
+    block_range = sum_block_range(block_hashes, block_nums, block_times, show_progress)
+    if block_cache_available and len(block_hashes) > 0:
+        try:
+            os.makedirs(range_cache_dir, exist_ok=True)
+            save_range_cache(block_hashes, *block_range)
+        except OSError as e:
+            print("\nCould not save parsed blocks in "+range_cache_dir+", continuing without them.")
+            print("Details:", e)
+            block_cache_available = False
+    return block_range
+
+
+# read in all blocks needed. Following new blocks afterwards needs every parsed block
+if not backfill_mode:
+    if daemon_mode:
+        block_range = sum_block_range(block_hashes_needed, block_nums_needed, block_times_needed, True, daemon_first_blocks)
+    elif block_mode:
+        block_range = sum_block_range(block_hashes_needed, block_nums_needed, block_times_needed, True)
+    else:
+        block_range = load_block_range(block_hashes_needed, block_nums_needed, block_times_needed, True)
+    output_histogram_bin_counts, raw_outputs, raw_output_blocks = block_range
+
+
+if not backfill_mode:
+    print("100%",flush=True)
+    print("\t\t\t\t\t\t95% done",flush=True)
+
+#keep the saved parsed blocks within their size limit
+if block_cache_available:
+    try:
+        trim_block_cache()
+    except OSError:
+        pass
 
             
 
@@ -911,16 +1665,9 @@ print("\t\t\t\t\t\t95% done",flush=True)
 
 
 # print update
-print("\nFinding prices and rendering plot",flush=True)
-print("0%..",end="",flush=True)
-
-#remove outputs below 10k sat (increased from 1k sat in v6)
-for n in range(0,201):
-    output_histogram_bin_counts[n]=0
-
-#remove outputs above ten btc
-for n in range(1601,len(output_histogram_bin_counts)):
-    output_histogram_bin_counts[n]=0
+if not backfill_mode:
+    print("\nFinding prices and rendering plot",flush=True)
+    print("0%..",end="",flush=True)
 
 #create a list of round btc bin numbers
 round_btc_bins = [
@@ -944,27 +1691,41 @@ round_btc_bins = [
 1201  # 1 btc
 ]
 
-#smooth over the round btc amounts
-for r in round_btc_bins:
-    amount_above = output_histogram_bin_counts[r+1]
-    amount_below = output_histogram_bin_counts[r-1]
-    output_histogram_bin_counts[r] = .5*(amount_above+amount_below)
-
-#get the sum of the curve
-curve_sum = 0.0
-for n in range(201,1601):
-    curve_sum += output_histogram_bin_counts[n]
-
-#normalize the curve by dividing by it's sum and removing extreme values
-for n in range(201,1601):
-    output_histogram_bin_counts[n] /= curve_sum
+#define the steps for removing round btc amounts and normalizing a histogram, which
+#change the histogram in place
+def remove_round_btc_amounts(bin_counts):
+    
+    #remove outputs below 10k sat (increased from 1k sat in v6)
+    for n in range(0,201):
+        bin_counts[n]=0
+
+    #remove outputs above ten btc
+    for n in range(1601,len(bin_counts)):
+        bin_counts[n]=0
+
+    #smooth over the round btc amounts
+    for r in round_btc_bins:
+        amount_above = bin_counts[r+1]
+        amount_below = bin_counts[r-1]
+        bin_counts[r] = .5*(amount_above+amount_below)
+
+    #get the sum of the curve
+    curve_sum = 0.0
+    for n in range(201,1601):
+        curve_sum += bin_counts[n]
+
+    #normalize the curve by dividing by it's sum and removing extreme values
+    for n in range(201,1601):
+        bin_counts[n] /= curve_sum
     
-    #remove extremes (0.008 chosen by historical testing)
-    if output_histogram_bin_counts[n] > 0.008:
-        output_histogram_bin_counts[n] = 0.008
+        #remove extremes (0.008 chosen by historical testing)
+        if bin_counts[n] > 0.008:
+            bin_counts[n] = 0.008
 
-#print update    
-print("20%..",end="",flush=True)
+#remove round btc amounts from the histogram of the blocks
+if not backfill_mode:
+    remove_round_btc_amounts(output_histogram_bin_counts)
+    print("20%..",end="",flush=True)
 
 
 
@@ -1069,12 +1830,13 @@ spike_stencil[801]= 0.000832244504868709  # $10000
 # the highest score. This gives us a rough estimate of the price, accurate to within 
 # about 0.5 percent.
 
+# Sliding a stencil across the histogram and scoring every position is what's known 
+# as a cross-correlation, so the scores of all slides are calculated at once. If 
+# NumPy is installed it does the calculation, otherwise plain Python does it while 
+# skipping the zeros in the stencil. Both give the same scores up to the last few 
+# digits of floating point rounding.
 
 
-# set up scores for sliding the stencil
-best_slide        = 0
-best_slide_score  = 0
-total_score       = 0
 
 #weighting of the smooth and spike slide scores
 smooth_weight     = 0.65
@@ -1089,71 +1851,97 @@ right_p001  = center_p001 + int((len(spike_stencil) +1)/2)
 min_slide = -141   # $500k
 max_slide =  201   # $5k
     
-#slide the stencil and calculate slide score
-for slide in range(min_slide,max_slide):
+#shortcut for sliding a stencil across a histogram. Returns the scores of
+#all slides from first_slide up to (not including) last_slide
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from operator import mul
+def slide_stencil_scores(bin_counts, stencil, first_slide, last_slide):
+    curve = bin_counts[left_p001+first_slide:left_p001+last_slide-1+len(stencil)]
     
-    #shift the bell curve by the slide
-    shifted_curve = output_histogram_bin_counts[left_p001+slide:right_p001+slide]
+    # let numpy do the whole cross-correlation if it's available
+    if numpy is not None:
+        return numpy.correlate(numpy.array(curve), numpy.array(stencil), "valid").tolist()
     
-    #score the smoothslide by multiplying the curve by the stencil
-    slide_score_smooth = 0.0
-    for n in range(0,len(smooth_stencil)):
-        slide_score_smooth += shifted_curve[n]*smooth_stencil[n]
+    # multiply the curve by the stencil at each slide, skipping zeros in the stencil
+    stencil_bins = [n for n in range(len(stencil)) if stencil[n] != 0.0]
+    stencil_weights = [stencil[n] for n in stencil_bins]
+    stencil_is_dense = len(stencil_bins) == len(stencil)
+    scores = []
+    for offset in range(last_slide - first_slide):
+        if stencil_is_dense:
+            shifted_curve = curve[offset:offset+len(stencil)]
+        else:
+            shifted_curve = [curve[offset+n] for n in stencil_bins]
+        scores.append(sum(map(mul, shifted_curve, stencil_weights)))
+    return scores
+
+#define the steps for estimating the rough price from a normalized histogram
+def estimate_rough_price(bin_counts):
+    
+    # set up scores for sliding the stencil
+    best_slide        = 0
+    best_slide_score  = 0
+    total_score       = 0
+
+    #score the spiky stencil at every slide, including one slide past each limit for the
+    #neighbors of the best slide
+    spike_scores = slide_stencil_scores(bin_counts, spike_stencil, min_slide-1, max_slide+1)
+
+    #score the smooth stencil where it's used, it's neglected over wrong regions
+    smooth_scores = slide_stencil_scores(bin_counts, smooth_stencil, min_slide, 150)
+
+    #add up the slide scores
+    for slide in range(min_slide,max_slide):
     
-    #score the spiky slide by multiplying the curve by the stencil
-    slide_score = 0.0
-    for n in range(0,len(spike_stencil)):
-        slide_score += shifted_curve[n]*spike_stencil[n]
+        #get the spiky slide score
+        slide_score = spike_scores[slide-min_slide+1]
     
-    # add the spike and smooth slide scores, neglect smooth slide over wrong regions
-    if slide < 150:
-        slide_score = slide_score + slide_score_smooth*.65
+        # add the spike and smooth slide scores, neglect smooth slide over wrong regions
+        if slide < 150:
+            slide_score = slide_score + smooth_scores[slide-min_slide]*.65
         
-    # see if this score is the best so far
-    if slide_score > best_slide_score:
-        best_slide_score = slide_score
-        best_slide = slide
+        # see if this score is the best so far
+        if slide_score > best_slide_score:
+            best_slide_score = slide_score
+            best_slide = slide
     
-    # increment the total score
-    total_score += slide_score
+        # increment the total score
+        total_score += slide_score
         
-# estimate the usd price of the best slide
-usd100_in_btc_best = output_histogram_bins[center_p001+best_slide]
-btc_in_usd_best = 100/(usd100_in_btc_best)
-
-#find best slide neighbor up
-neighbor_up = output_histogram_bin_counts[left_p001+best_slide+1:right_p001+best_slide+1]
-neighbor_up_score = 0.0
-for n in range(0,len(spike_stencil)):
-    neighbor_up_score += neighbor_up[n]*spike_stencil[n]
-
-#find best slide neighbor down
-neighbor_down = output_histogram_bin_counts[left_p001+best_slide-1:right_p001+best_slide-1]
-neighbor_down_score = 0.0
-for n in range(0,len(spike_stencil)):
-    neighbor_down_score += neighbor_down[n]*spike_stencil[n]
-
-#get best neighbor
-best_neighbor = +1
-neighbor_score = neighbor_up_score
-if neighbor_down_score > neighbor_up_score:
-    best_neighbor = -1
-    neighbor_score = neighbor_down_score
-
-#get best neighbor usd price
-usd100_in_btc_2nd = output_histogram_bins[center_p001+best_slide+best_neighbor]
-btc_in_usd_2nd = 100/(usd100_in_btc_2nd)
-
-#weight average the two usd price estimates
-avg_score = total_score/len(range(min_slide,max_slide))
-a1 = best_slide_score - avg_score
-a2 = abs(neighbor_score - avg_score)
-w1 = a1/(a1+a2)
-w2 = a2/(a1+a2)
-rough_price_estimate = int(w1*btc_in_usd_best + w2*btc_in_usd_2nd)
-
-# Print update
-print("40%..",end="",flush=True)
+    # estimate the usd price of the best slide
+    usd100_in_btc_best = output_histogram_bins[center_p001+best_slide]
+    btc_in_usd_best = 100/(usd100_in_btc_best)
+
+    #find best slide neighbor up and down
+    neighbor_up_score = spike_scores[best_slide-min_slide+2]
+    neighbor_down_score = spike_scores[best_slide-min_slide]
+
+    #get best neighbor
+    best_neighbor = +1
+    neighbor_score = neighbor_up_score
+    if neighbor_down_score > neighbor_up_score:
+        best_neighbor = -1
+        neighbor_score = neighbor_down_score
+
+    #get best neighbor usd price
+    usd100_in_btc_2nd = output_histogram_bins[center_p001+best_slide+best_neighbor]
+    btc_in_usd_2nd = 100/(usd100_in_btc_2nd)
+
+    #weight average the two usd price estimates
+    avg_score = total_score/len(range(min_slide,max_slide))
+    a1 = best_slide_score - avg_score
+    a2 = abs(neighbor_score - avg_score)
+    w1 = a1/(a1+a2)
+    w2 = a2/(a1+a2)
+    return int(w1*btc_in_usd_best + w2*btc_in_usd_2nd)
+
+#estimate the rough price from the histogram of the blocks
+if not backfill_mode:
+    rough_price_estimate = estimate_rough_price(output_histogram_bin_counts)
+    print("40%..",end="",flush=True)
 
 
 
@@ -1182,6 +1970,11 @@ print("40%..",end="",flush=True)
 # identify and exclude round BTC amounts by checking whether an output falls within 
 # a narrow range around common round BTC values.
 
+# Both the USD ranges and the round BTC ranges are worked out once before looking at 
+# any outputs. They're kept as sorted lists of where each range starts, so for every 
+# output a binary search (bisect) finds which USD amounts it could be and whether it's 
+# a round BTC amount, instead of checking it against every range one by one.
+
 
 
 # list of round USD prices to collect outputs from
@@ -1190,70 +1983,108 @@ usds = [5,10,15,20,25,30,40,50,100,150,200,300,500,1000]
 # pct of price increase of decrease to include
 pct_range_wide = .25
 
-# filter for micro round satoshi amounts
+# filter for micro round satoshi amounts, kept as whole sats so the list is exact
 micro_remove_list = []
-i = .00005000
-while i<.0001:
+i = 5000
+while i<10000:
     micro_remove_list.append(i)
-    i += .00001
-i = .0001
-while i<.001:
+    i += 1000
+i = 10000
+while i<100000:
     micro_remove_list.append(i)
-    i += .00001
-i = .001
-while i<.01:
+    i += 1000
+i = 100000
+while i<1000000:
     micro_remove_list.append(i)
-    i += .0001
-i = .01
-while i<.1:
+    i += 10000
+i = 1000000
+while i<10000000:
     micro_remove_list.append(i)
-    i += .001
-i = .1
-while i<1:
+    i += 100000
+i = 10000000
+while i<100000000:
     micro_remove_list.append(i)
-    i += .01
-pct_micro_remove = .0001
-
-# init output prices list
-output_prices = []
-output_blocks = []
-output_times = []
+    i += 1000000
+
+# remove sats within 1/10000 (0.01%) of a round amount
+micro_remove_parts = 10000
+
+# calculate the whole sats removed around every round amount and merge the ranges
+# that touch, keeping where each merged range starts and ends
+round_sats_starts = []
+round_sats_ends = []
+for r in sorted(micro_remove_list):
+    rm_dn = (micro_remove_parts - 1) * r // micro_remove_parts + 1
+    rm_up = -(-(micro_remove_parts + 1) * r // micro_remove_parts) - 1
+    if len(round_sats_ends) > 0 and rm_dn <= round_sats_ends[-1] + 1:
+        round_sats_ends[-1] = max(round_sats_ends[-1], rm_up)
+    else:
+        round_sats_starts.append(rm_dn)
+        round_sats_ends.append(rm_up)
 
-#loop through all outputs
-for i in range (0,len(raw_outputs)):
-    
-    #get the amount, height and time of the next output
-    n = raw_outputs[i]
-    b = block_heights_dec[i]
-    t = block_times_dec[i]
+#define the steps for turning the outputs of the blocks into price points around the
+#rough price. Returns the price, block height and block time of each price point
+from math import floor, ceil
+def create_price_points(rough_price_estimate, raw_outputs, raw_output_blocks):
     
-    #loop throughll usd amounts possible
+    # calculate the sats range of every usd amount once, an output is inside the range if
+    # it's larger than the lower bound and smaller than the upper bound, both in whole sats
+    usd_sats_ranges = []
     for usd in usds:
+        avsats = usd * 100000000 / rough_price_estimate
+        sats_up = ceil(avsats + pct_range_wide * avsats)
+        sats_dn = floor(avsats - pct_range_wide * avsats)
+        usd_sats_ranges.append((usd, sats_dn, sats_up))
+
+    # split the sats amounts into pieces wherever a usd range starts or ends, and list the
+    # usd amounts covering each piece in the same order as usds
+    usd_piece_starts = []
+    for usd, sats_dn, sats_up in usd_sats_ranges:
+        usd_piece_starts.append(sats_dn + 1)
+        usd_piece_starts.append(sats_up)
+    usd_piece_starts = sorted(set(usd_piece_starts))
+    usd_piece_usds = []
+    for piece_start in usd_piece_starts:
+        piece_usds = []
+        for usd, sats_dn, sats_up in usd_sats_ranges:
+            if sats_dn < piece_start < sats_up:
+                piece_usds.append(usd)
+        usd_piece_usds.append(piece_usds)
+
+    # init output prices list
+    output_prices = []
+    output_blocks = []
+    output_times = []
+
+    #loop through all outputs, one block at a time
+    for first_output, end_output, b, t in raw_output_blocks:
+        for i in range (first_output,end_output):
+        
+            #get the amount of the next output in sats
+            n = raw_outputs[i]
+        
+            #find the usd amounts this output could be, if any
+            piece = bisect_right(usd_piece_starts, n) - 1
+            if piece < 0 or len(usd_piece_usds[piece]) == 0:
+                continue
         
-        #calculate the upper and lower bounds for the USD range
-        avbtc = usd/rough_price_estimate
-        btc_up = avbtc + pct_range_wide * avbtc 
-        btc_dn = avbtc - pct_range_wide * avbtc
-    
-        # check if inside price bounds
-        if btc_dn < n < btc_up:
-            append = True
-            
             #remove perfectly round sats
-            for r in micro_remove_list:
-                
-                rm_dn = r - pct_micro_remove * r
-                rm_up = r + pct_micro_remove * r
-                if rm_dn < n < rm_up:
-                    append = False
-            
+            round_range = bisect_right(round_sats_starts, n) - 1
+            if round_range >= 0 and n <= round_sats_ends[round_range]:
+                continue
+        
             # if in price range and not perfectly round sat, add to list
-            if append:
-                output_prices.append(usd/n)
+            for usd in usd_piece_usds[piece]:
+                output_prices.append(usd * 100000000 / n)
                 output_blocks.append(b)
                 output_times.append(t)
 
-print("60%..",end="",flush=True)
+    return output_prices, output_blocks, output_times
+
+#create the price points from the outputs of the blocks
+if not backfill_mode:
+    output_prices, output_blocks, output_times = create_price_points(rough_price_estimate, raw_outputs, raw_output_blocks)
+    print("60%..",end="",flush=True)
 
 
 
@@ -1278,97 +2109,121 @@ print("60%..",end="",flush=True)
 # The final exact price is determined by one of two conditions: A) the converged 
 # center price, or B) the first central value where stable oscillation begins.
 
+# The price points are sorted once, and every window is then a slice of the sorted list 
+# that's found with a binary search (bisect). The central output is the point with the 
+# smallest total distance to all other points in the window. In a sorted window a 
+# running sum of the points to the left of each point gives its total distance in one 
+# pass, without building any lists. The distances are added up in the same order as 
+# always, so when the two middle points of an even count are equally central, the same 
+# one wins. The deviations from the central output grow in order when walking away 
+# from it in both directions, so their median is found by stepping outward from the 
+# center, always taking the closer side, until half of the points are passed.
+
 
 # define an algorithm for finding the central price point and avg deviation
-def find_central_output(r2, price_min, price_max):
+from bisect import bisect_left
+def find_central_output(sorted_prices, price_min, price_max):
     
-    #sort the list of prices
-    r6 = [r for r in r2 if price_min < r < price_max]
-    outputs = sorted(r6)
-    n = len(outputs)
-
-    # Prefix sums
-    prefix_sum = []
+    #find the window of sorted prices between the min and max
+    first = bisect_right(sorted_prices, price_min)
+    end = bisect_left(sorted_prices, price_max)
+    m = end - first
+    if m == 0:
+        raise ValueError("min() arg is an empty sequence")
+    
+    # find the total distance to other points, keeping the first most central output
     total = 0
-    for x in outputs:
-        total += x
-        prefix_sum.append(total)
-
-    # count the number of point left and right
-    left_counts = list(range(n))
-    right_counts = [n - i - 1 for i in left_counts]
-    left_sums = [0] + prefix_sum[:-1]
-    right_sums = [total - x for x in prefix_sum]
-
-    # find the total distance to other points
-    total_dists = []
-    for i in range(n):
-        dist = (outputs[i] * left_counts[i] - left_sums[i]) + (right_sums[i] - outputs[i] * right_counts[i])
-        total_dists.append(dist)
-
-    # find the Most central output
-    min_index, _ = min(enumerate(total_dists), key=lambda x: x[1])
-    best_output = outputs[min_index]
-
-    # Median absolute deviation
-    deviations = [abs(x - best_output) for x in outputs]
-    deviations.sort()
-    m = len(deviations)
+    for i in range(first, end):
+        total += sorted_prices[i]
+    left_sum = 0
+    min_dist = None
+    for i in range(first, end):
+        x = sorted_prices[i]
+        prefix_sum = left_sum + x
+        dist = (x * (i - first) - left_sum) + ((total - prefix_sum) - x * (end - i - 1))
+        if min_dist is None or dist < min_dist:
+            min_dist = dist
+            center = i
+        left_sum = prefix_sum
+    best_output = sorted_prices[center]
+
+    # Median absolute deviation, walk outward from the center taking the smaller
+    # deviation each step until reaching the middle deviation(s)
+    left = center
+    right = center + 1
+    deviations_middle = []
+    for rank in range(m // 2 + 1):
+        if right >= end or (left >= first and best_output - sorted_prices[left] <= sorted_prices[right] - best_output):
+            deviation = best_output - sorted_prices[left]
+            left -= 1
+        else:
+            deviation = sorted_prices[right] - best_output
+            right += 1
+        if rank >= m // 2 - 1:
+            deviations_middle.append(deviation)
     if m % 2 == 0:
-        mad = (deviations[m//2 - 1] + deviations[m//2]) / 2
+        mad = (deviations_middle[0] + deviations_middle[1]) / 2
     else:
-        mad = deviations[m//2]
+        mad = deviations_middle[-1]
 
     return best_output, mad
 
 
-# use a tight pct range to find the first central price
-pct_range_tight = .05
-price_up = rough_price_estimate + pct_range_tight * rough_price_estimate 
-price_dn = rough_price_estimate - pct_range_tight * rough_price_estimate
-central_price, av_dev = find_central_output(output_prices,price_dn,price_up)
+#define the steps for finding the exact price from the price points, starting from the
+#rough price. Returns the exact price and the price range to show on the plot
+def find_exact_price(output_prices, rough_price_estimate):
+    
+    # sort the price points once
+    sorted_output_prices = sorted(output_prices)
 
-# find the deviation as a percentage of the price range
-price_range = price_up - price_dn
-dev_pct = av_dev/price_range
+    # use a tight pct range to find the first central price
+    pct_range_tight = .05
+    price_up = rough_price_estimate + pct_range_tight * rough_price_estimate 
+    price_dn = rough_price_estimate - pct_range_tight * rough_price_estimate
+    central_price, av_dev = find_central_output(sorted_output_prices,price_dn,price_up)
 
-# iteratively re-center the bounds and find a new center price until convergence
-avs = set()
-avs.add(central_price)
-while central_price not in avs:
-    avs.add(central_price)
-    price_up = central_price + pct_range_tight * central_price 
-    price_dn = central_price - pct_range_tight * central_price
-    central_price, av_dev = find_central_output(output_prices,price_dn,price_up)
+    # find the deviation as a percentage of the price range
     price_range = price_up - price_dn
     dev_pct = av_dev/price_range
 
-#print update
-print("80%..",end="",flush=True)
-
-#because price flutucation may exceed bounds, check a wide ranger for the devation
-pct_range_med = .1
-price_up = central_price + pct_range_med * central_price 
-price_dn = central_price - pct_range_med * central_price
-price_range = price_up - price_dn
-unused_price, av_dev = find_central_output(output_prices,price_dn,price_up)
-dev_pct = av_dev/price_range
+    # iteratively re-center the bounds and find a new center price until convergence
+    avs = set()
+    avs.add(central_price)
+    while central_price not in avs:
+        avs.add(central_price)
+        price_up = central_price + pct_range_tight * central_price 
+        price_dn = central_price - pct_range_tight * central_price
+        central_price, av_dev = find_central_output(sorted_output_prices,price_dn,price_up)
+        price_range = price_up - price_dn
+        dev_pct = av_dev/price_range
+
+    #because price flutucation may exceed bounds, check a wide ranger for the devation
+    pct_range_med = .1
+    price_up = central_price + pct_range_med * central_price 
+    price_dn = central_price - pct_range_med * central_price
+    price_range = price_up - price_dn
+    unused_price, av_dev = find_central_output(sorted_output_prices,price_dn,price_up)
+    dev_pct = av_dev/price_range
 
-# use the pct deviation of data to set y axis range
-map_dev_axr = (.15-.05)/(.20-.17)
-ax_range = .05+ (dev_pct-.17)*map_dev_axr
+    # use the pct deviation of data to set y axis range
+    map_dev_axr = (.15-.05)/(.20-.17)
+    ax_range = .05+ (dev_pct-.17)*map_dev_axr
 
-#set max and min y axis ranges
-if ax_range < .05:
-    ax_range = .05
-if ax_range > .2:
-    ax_range = .2
-price_up = central_price + ax_range * central_price 
-price_dn = central_price - ax_range * central_price
+    #set max and min y axis ranges
+    if ax_range < .05:
+        ax_range = .05
+    if ax_range > .2:
+        ax_range = .2
+    price_up = central_price + ax_range * central_price 
+    price_dn = central_price - ax_range * central_price
 
+    return central_price, price_dn, price_up
 
-# print update
-print("100%\t\t\tdone",flush=True)
+#find the exact price from the price points of the blocks
+if not backfill_mode:
+    central_price, price_dn, price_up = find_exact_price(output_prices, rough_price_estimate)
+    print("80%..",end="",flush=True)
+    print("100%\t\t\tdone",flush=True)
 if date_mode:
     print("\n\n\t\t"+price_day_date_utc+" price: $"+f"{int(central_price):,}\n\n",flush=True)
 
@@ -1398,67 +2253,70 @@ margin_right = 90
 margin_top = 100
 margin_bottom = 120
 
-# #get linear block hieghts on x axis
-start = block_nums_needed[0]
-end = block_nums_needed[-1]
-count = len(output_prices)
-step = (end - start) / (count - 1) if count > 1 else 0
-b3 = [start + i * step for i in range(count)]
-
-#Prepare python prices, heights, and timestamps for sending to html
-heights = []
-heights_smooth = []
-timestamps = []
-prices = []
-for i in range(len(output_prices)):
-    if price_dn < output_prices[i] < price_up:
-        heights.append(output_blocks[i])
-        heights_smooth.append(b3[i])
-        timestamps.append(output_times[i])
-        prices.append(output_prices[i])
-
-# Sort by timestamps (optional, looks nicer)
-heights_smooth, prices = zip(*sorted(zip(heights_smooth, prices)))
-
-# set x tick locations
-num_ticks = 5
-n = len(heights_smooth)
-tick_indxs = [round(i * (n - 1) / (num_ticks - 1)) for i in range(num_ticks)]
-
-# Set the x tick labels 
-xtick_positions = []
-xtick_labels = []
-for tk in tick_indxs:
-    xtick_positions.append(heights_smooth[tk])
-    block_height = heights[tk]
-    timestamp = timestamps[tk]
-    dt = datetime.utcfromtimestamp(timestamp)
-    time_label = f"{dt.hour:02}:{dt.minute:02} UTC"
-    label = f"{block_height}\n{time_label}"  # comma after 3 digits
-    xtick_labels.append(label)
-
-# Calculate avg price
-avg_price = central_price
-
-#set the plot annotations
-plot_title_left = ""
-plot_title_right = ""
-bottom_note1 = ""
-bottom_note2 = ""
-if date_mode:
-    plot_title_left = price_day_date_utc+" blocks from local node"
-    plot_title_right ="UTXOracle Consensus Price $"+f"{int(central_price):,} "#+test_price
-    bottom_note1 = "Consensus Data:"
-    bottom_note2 = "this plot is identical and immutable for every bitcoin node"
-if block_mode:
-    plot_title_left = "Local Node Blocks "+str(block_start_num)+"-"+str(block_finish_num)
-    plot_title_right ="UTXOracle Block Window Price $"+f"{int(central_price):,}"
-    bottom_note1 = "* Block Window Price "
-    bottom_note2 = "may have node dependent differences data on the chain tip"
-
-
-# Write the HTML code for the chart
-html_content = f'''<!DOCTYPE html>
+#define the steps for generating the html page of the plot. Returns the page as text
+def generate_price_plot(central_price, price_dn, price_up, output_prices, output_blocks, output_times, block_start_num, block_finish_num):
+    
+    # #get linear block hieghts on x axis
+    start = block_start_num
+    end = block_finish_num - 1
+    count = len(output_prices)
+    step = (end - start) / (count - 1) if count > 1 else 0
+    b3 = [start + i * step for i in range(count)]
+
+    #Prepare python prices, heights, and timestamps for sending to html
+    heights = []
+    heights_smooth = []
+    timestamps = []
+    prices = []
+    for i in range(len(output_prices)):
+        if price_dn < output_prices[i] < price_up:
+            heights.append(output_blocks[i])
+            heights_smooth.append(b3[i])
+            timestamps.append(output_times[i])
+            prices.append(output_prices[i])
+
+    # Sort by timestamps (optional, looks nicer)
+    heights_smooth, prices = zip(*sorted(zip(heights_smooth, prices)))
+
+    # set x tick locations
+    num_ticks = 5
+    n = len(heights_smooth)
+    tick_indxs = [round(i * (n - 1) / (num_ticks - 1)) for i in range(num_ticks)]
+
+    # Set the x tick labels 
+    xtick_positions = []
+    xtick_labels = []
+    for tk in tick_indxs:
+        xtick_positions.append(heights_smooth[tk])
+        block_height = heights[tk]
+        timestamp = timestamps[tk]
+        dt = datetime.utcfromtimestamp(timestamp)
+        time_label = f"{dt.hour:02}:{dt.minute:02} UTC"
+        label = f"{block_height}\n{time_label}"  # comma after 3 digits
+        xtick_labels.append(label)
+
+    # Calculate avg price
+    avg_price = central_price
+
+    #set the plot annotations
+    plot_title_left = ""
+    plot_title_right = ""
+    bottom_note1 = ""
+    bottom_note2 = ""
+    if date_mode:
+        plot_title_left = price_day_date_utc+" blocks from local node"
+        plot_title_right ="UTXOracle Consensus Price $"+f"{int(central_price):,} "#+test_price
+        bottom_note1 = "Consensus Data:"
+        bottom_note2 = "this plot is identical and immutable for every bitcoin node"
+    if block_mode:
+        plot_title_left = "Local Node Blocks "+str(block_start_num)+"-"+str(block_finish_num)
+        plot_title_right ="UTXOracle Block Window Price $"+f"{int(central_price):,}"
+        bottom_note1 = "* Block Window Price "
+        bottom_note2 = "may have node dependent differences data on the chain tip"
+
+
+    # Write the HTML code for the chart
+    html_content = f'''<!DOCTYPE html>
 
 <html>
 <head>
@@ -1780,6 +2638,12 @@ Want a
 </html>
 '''
 
+    return html_content
+
+#generate the html page for the blocks
+if not backfill_mode:
+    html_content = generate_price_plot(central_price, price_dn, price_up, output_prices, output_blocks, output_times, block_start_num, block_finish_num)
+
 
 # name the file with dates or blocks
 filename = ".html"
@@ -1787,14 +2651,477 @@ if date_mode:
     filename = "UTXOracle_"+price_date_dash+filename
 if block_mode:
     filename = "UTXOracle_"+str(block_start_num)+"-"+str(block_finish_num)+filename
+if daemon_mode:
+    filename = "UTXOracle_latest.html"
 
 
 # Write file locally and serve to browser
 import webbrowser
-with open(filename, "w") as f:
-    f.write(html_content)
-webbrowser.open('file://' + os.path.realpath(filename))
+if not backfill_mode:
+    with open(filename, "w") as f:
+        f.write(html_content)
+    webbrowser.open('file://' + os.path.realpath(filename))
+
+
+
+
+##############################################################################
+
+# Step 13 - Follow New Blocks
+
+##############################################################################
+
+# In daemon mode (--daemon) the program doesn't stop after the first plot. It keeps 
+# the parsed blocks of the 144 block window in memory and waits for new blocks. When 
+# the node has a new block, the window moves forward: the new block is added to the 
+# end and the oldest block is dropped from the start. Only the histogram counts and 
+# price points of those two blocks change, so Steps 7 to 12 can be run again right away 
+# without downloading or parsing the other 143 blocks.
+
+# Moving the start of the window also changes the same day inputs filter. A transaction 
+# that was left out because it spends a txid from the dropped block may now spend only 
+# txids from before the window, so it's counted again. To find these quickly, we keep 
+# the height of the block that made every txid in the window, and for every transaction 
+# left out, the height of the newest window block it spends from. If a block in the 
+# window is replaced by a different one (a chain reorganization), the window is simply 
+# loaded again. This is checked whenever the best block hash changes, even if the new 
+# best block has the same height as the old one.
+
+# While following blocks, the header index is kept up to date with the node and the 
+# saved parsed blocks are trimmed to --cache-size after every new block, the same as 
+# at the end of a normal run. If the node fails to answer while the window is moved, 
+# the error is printed and the update is tried again one poll time later, loading the 
+# whole window again if it was only partly moved.
+
+# The html page is written to UTXOracle_latest.html after every new block, and the new 
+# price is printed.
+
+# To find out about new blocks without asking the node over and over, the program 
+# sends the node a waitfornewblock request, which the node holds open until a new 
+# block arrives or the poll time passes. The request includes the best block hash the 
+# program already has, so a block that arrives just before the request is sent is 
+# answered right away. Nodes older than that argument are sent the request without 
+# it, and a block arriving in that moment is then found one poll time later. Nodes 
+# that don't have or don't allow waitfornewblock are simply asked for their best 
+# block hash every poll time instead. Any other failure, like a busy node, only means 
+# waiting one poll time and trying again. The same goes for asking the best block hash, 
+# so the program keeps running while the node restarts.
+
+# If you'd rather have the node tell the program directly, start bitcoind with 
+# -blocknotify="echo %s > /path/to/fifo" and run the program with --notify /path/to/fifo. 
+# Either way, the price is only calculated again when the best block hash changes.
+
+
+#the window of parsed blocks, oldest first. Each block is a list of its height, hash,
+#time, txids, kept transactions and whether each kept transaction is counted
+window_blocks = deque()
+window_txid_heights = {}
+window_waiting = {}
+window_bin_counts = [0.0] * number_of_bins
+
+#shortcut for adding or taking away the outputs of a transaction in the window histogram
+def count_window_outputs(output_values, count):
+    for amount_sats in output_values:
+        bin_number = bisect_right(output_histogram_bin_sats, amount_sats) - 1
+        window_bin_counts[bin_number] += count
+
+#shortcut for the height of the newest window block a transaction spends from, or -1
+def newest_spent_height(spent_txids):
+    return max([window_txid_heights.get(spent_txid, -1) for spent_txid in spent_txids], default=-1)
+
+#add a parsed block to the end of the window
+def add_window_block(height, block_hash, block_time, parsed_block):
+    block_txids, candidates, block_histogram = parsed_block
+    block = [height, block_hash, block_time, block_txids, candidates, [True] * len(candidates)]
+    
+    #add the block's histogram, then take back the txs that spend from the window
+    for bin_number, bin_count in block_histogram:
+        window_bin_counts[bin_number] += bin_count
+    for k in range(len(candidates)):
+        spent_txids, output_values = candidates[k]
+        spent_height = newest_spent_height(spent_txids)
+        if spent_height >= 0:
+            block[5][k] = False
+            count_window_outputs(output_values, -1.0)
+            window_waiting.setdefault(spent_height, []).append((block, k))
+    
+    #remember where the block's txids came from
+    for txid in block_txids:
+        window_txid_heights[txid] = height
+    window_blocks.append(block)
+
+#drop the oldest block from the start of the window
+def remove_oldest_window_block():
+    height, block_hash, block_time, block_txids, candidates, is_counted = window_blocks.popleft()
+    
+    #take away the outputs the block added and forget its txids
+    for k in range(len(candidates)):
+        if is_counted[k]:
+            count_window_outputs(candidates[k][1], -1.0)
+    for txid in block_txids:
+        if window_txid_heights.get(txid) == height:
+            del window_txid_heights[txid]
+    
+    #txs left out for spending from this block are counted unless they spend from a newer one
+    for block, k in window_waiting.pop(height, []):
+        spent_txids, output_values = block[4][k]
+        spent_height = newest_spent_height(spent_txids)
+        if spent_height >= 0:
+            window_waiting.setdefault(spent_height, []).append((block, k))
+        else:
+            block[5][k] = True
+            count_window_outputs(output_values, 1.0)
+
+#empty the window
+def clear_window():
+    window_blocks.clear()
+    window_txid_heights.clear()
+    window_waiting.clear()
+    for n in range(number_of_bins):
+        window_bin_counts[n] = 0.0
+
+#run steps 7 to 12 on the window, write the html page and return the price
+def update_window_price():
+    
+    #collect the counted outputs of the window one block at a time
+    window_outputs = array('Q')
+    window_output_blocks = []
+    for height, block_hash, block_time, block_txids, candidates, is_counted in window_blocks:
+        first_output = len(window_outputs)
+        for k in range(len(candidates)):
+            if is_counted[k]:
+                window_outputs.extend(candidates[k][1])
+        if len(window_outputs) > first_output:
+            window_output_blocks.append((first_output, len(window_outputs), height, block_time))
+    
+    #find the price the same way as for the first window
+    bin_counts = list(window_bin_counts)
+    remove_round_btc_amounts(bin_counts)
+    rough_price_estimate = estimate_rough_price(bin_counts)
+    output_prices, output_blocks, output_times = create_price_points(rough_price_estimate, window_outputs, window_output_blocks)
+    central_price, price_dn, price_up = find_exact_price(output_prices, rough_price_estimate)
+    
+    #write the page to a temporary file first so a browser never reads half of it
+    html_content = generate_price_plot(central_price, price_dn, price_up, output_prices, output_blocks, 
+        output_times, window_blocks[0][0], window_blocks[-1][0] + 1)
+    with open(filename + ".tmp", "w") as f:
+        f.write(html_content)
+    os.replace(filename + ".tmp", filename)
+    return central_price
+
+#open the fifo bitcoind's blocknotify command writes to, making it if needed
+import select
+def open_notify_fifo(path):
+    if not hasattr(os, "mkfifo"):
+        print("Block notifications need a fifo, which this system doesn't have. Polling the node instead.")
+        return None
+    if not os.path.exists(path):
+        os.mkfifo(path)
+    fifo_fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    
+    #keep the fifo open for writing too, so it doesn't read as closed between notifications
+    os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+    return fifo_fd
+
+#ask the node to hold a waitfornewblock request until its best block hash isn't tip_hash,
+#or the poll time passes. Returns "waited", or why the node didn't wait: "unsupported"
+#if it doesn't have or allow the method (http 404 or error -32601, http 403 from an
+#rpcwhitelist), "no current_tip" if it's too old to take the tip argument (error -1),
+#or "failed" for anything else
+def ask_node_to_wait(tip_hash, long_poll):
+    params = [daemon_poll_seconds * 1000]
+    if long_poll == "current_tip":
+        params.append(tip_hash)
+    payload = json.dumps({
+        "jsonrpc": "1.0",
+        "id": "utxoracle",
+        "method": "waitfornewblock",
+        "params": params
+    })
+    try:
+        status, reason, raw_data = rpc_post_status(payload)
+        error = json.loads(raw_data).get("error") if raw_data else None
+    except (http.client.HTTPException, OSError, ValueError):
+        return "failed"
+    if status in (403, 404) or (error and error.get("code") == -32601):
+        return "unsupported"
+    if error and error.get("code") == -1 and long_poll == "current_tip":
+        return "no current_tip"
+    if status != 200 or error:
+        return "failed"
+    return "waited"
+
+#ask the node for its best block hash, or None if it can't be reached right now, like
+#while it restarts. A missing cookie file ends the program with sys.exit, so that's
+#caught too
+def ask_node_best_hash():
+    try:
+        return Ask_Node(['getbestblockhash'], True)
+    except SystemExit:
+        return None
+
+#wait until the node's best block hash is different from tip_hash. long_poll is how the
+#node is asked to wait: "current_tip", "timeout" for nodes without the tip argument, or
+#"off". Returns the new hash and how to ask next time
+def wait_for_new_tip(tip_hash, notify_fd, long_poll):
+    node_answered = True
+    while True:
+        
+        #keep asking every poll time while the node can't be reached
+        best_hash = ask_node_best_hash()
+        if best_hash is None:
+            if node_answered:
+                print(datetime.now(timezone.utc).strftime("%H:%M:%S")+" the node isn't answering, trying again every "+
+                    str(daemon_poll_seconds)+" seconds",flush=True)
+            node_answered = False
+            time.sleep(daemon_poll_seconds)
+            continue
+        node_answered = True
+        if best_hash != tip_hash:
+            return best_hash, long_poll
+        
+        #wait for bitcoind to write to the fifo, and empty it
+        if notify_fd is not None:
+            readable, writable, failed = select.select([notify_fd], [], [], daemon_poll_seconds)
+            if readable:
+                os.read(notify_fd, 65536)
+        
+        #or let the node hold the request until it has a new block
+        elif long_poll != "off":
+            wait_result = ask_node_to_wait(best_hash, long_poll)
+            if wait_result == "unsupported":
+                long_poll = "off"
+            elif wait_result == "no current_tip":
+                long_poll = "timeout"
+            elif wait_result == "failed":
+                time.sleep(daemon_poll_seconds)
+        
+        #or just wait and ask again
+        else:
+            time.sleep(daemon_poll_seconds)
+
+#follow new blocks until stopped
+if daemon_mode:
+    notify_fd = None
+    if notify_fifo:
+        notify_fd = open_notify_fifo(notify_fifo)
+    print("\nFollowing new blocks, press Ctrl+C to stop",flush=True)
+    
+    #start with the blocks of the first window
+    for k in range(len(block_nums_needed)):
+        add_window_block(block_nums_needed[k], block_hashes_needed[k], block_times_needed[k], daemon_first_blocks[k])
+    del daemon_first_blocks[:]
+    window_end = block_finish_num
+    tip_hash = None
+    long_poll = "current_tip"
+    
+    try:
+        while True:
+            
+            #wait for the node to have a new block
+            tip_hash, long_poll = wait_for_new_tip(tip_hash, notify_fd, long_poll)
+            
+            #a failed request ends the program everywhere else, so here it's caught and
+            #the update is tried again after the poll time. A window that was only
+            #partly updated is loaded again from the start
+            window_updating = False
+            try:
+                
+                #a new tip at the same height only matters if it also replaced the last
+                #block of the window
+                block_count = get_block_count()
+                if block_count == window_end and get_block_hash(window_end - 1) == window_blocks[-1][1]:
+                    continue
+                start_time = time.time()
+                
+                #bring the header index up to the node's chain, so it can't give hashes of
+                #blocks that were replaced
+                if use_cache:
+                    try:
+                        update_header_index(block_count - 6)
+                    except OSError as e:
+                        print("\nCould not save the block header index in "+cache_dir+", continuing without it.")
+                        print("Details:", e)
+                        use_cache = False
+                
+                #get the hashes of the new window and load it again if a block was replaced
+                window_heights = list(range(block_count - 144, block_count))
+                times, hashes = get_block_times(window_heights)
+                window_updating = True
+                for block in window_blocks:
+                    k = block[0] - window_heights[0]
+                    if block[0] >= block_count or (k >= 0 and hashes[k] != block[1]):
+                        clear_window()
+                        break
+                
+                #drop the blocks before the window and add the new ones
+                while len(window_blocks) > 0 and window_blocks[0][0] < window_heights[0]:
+                    remove_oldest_window_block()
+                k = 0
+                if len(window_blocks) > 0:
+                    k = window_blocks[-1][0] + 1 - window_heights[0]
+                for new_height, new_hash, new_time, parsed_block in zip(window_heights[k:], hashes[k:], times[k:], load_blocks_in_order(hashes[k:])):
+                    add_window_block(new_height, new_hash, new_time, parsed_block)
+                window_updating = False
+                window_end = block_count
+                
+                #find the new price
+                central_price = update_window_price()
+                print(datetime.now(timezone.utc).strftime("%H:%M:%S")+" blocks "+str(window_heights[0])+"-"+str(block_count)+
+                    " price: $"+f"{int(central_price):,}"+f" ({time.time() - start_time:.2f}s)",flush=True)
+                
+                #keep the saved parsed blocks within their size limit
+                if block_cache_available:
+                    try:
+                        trim_block_cache()
+                    except OSError:
+                        pass
+            
+            #node errors were already printed before sys.exit
+            except (Exception, SystemExit) as e:
+                print(datetime.now(timezone.utc).strftime("%H:%M:%S")+" could not update the price, trying again in "+
+                    str(daemon_poll_seconds)+" seconds",flush=True)
+                if not isinstance(e, SystemExit):
+                    print("Details:", repr(e),flush=True)
+                if window_updating:
+                    clear_window()
+                window_end = None
+                tip_hash = None
+                time.sleep(daemon_poll_seconds)
+    except KeyboardInterrupt:
+        print("\nStopped following new blocks",flush=True)
 
 
 
 
+##############################################################################
+
+# Step 14 - Backfill Daily Prices
+
+##############################################################################
+
+# Finding the price history of many days (--backfill) could be done by running the 
+# program once for every date, but each run would connect to the node, read the 
+# conf file and header index and search for its day's blocks all over again. Instead, 
+# a single run found the blocks of every day in step 4, and here it finds each day's 
+# price the same way steps 6 to 11 find the price of one day. Parsed blocks are read 
+# from the cache folder when they were saved by an earlier run.
+
+# Days don't depend on each other, so with the --workers option several days are 
+# worked on at once, each on its own process. Every process opens its own connections 
+# to the node, and parses the blocks of its day by itself.
+
+# The price of every day is added to UTXOracle_backfill.csv as soon as it's found, in 
+# date order. The file is also the checkpoint: days that are already in it are skipped, 
+# so a backfill that was stopped continues where it left off when it's run again. A day 
+# whose price can't be found, for example because the node didn't answer, is reported 
+# and left out, and the backfill goes on with the next day. Running the same command 
+# again adds the missing days to the end of the file. The saved parsed blocks are kept 
+# within --cache-size every minute while days are found, since a long backfill saves a 
+# lot of them.
+
+
+#find the price of one day from its first block to the first block of the next day
+def find_day_price(day_blocks):
+    day_seconds, day_start_block, day_end_block = day_blocks
+    day_block_nums = list(range(day_start_block, day_end_block))
+    day_block_times, day_block_hashes = get_block_times(day_block_nums)
+    
+    #load the blocks, taking back the outputs of txs that spend a txid from earlier that day
+    day_bin_counts, day_outputs, day_output_blocks = load_block_range(day_block_hashes, day_block_nums, day_block_times)
+    
+    #find the price with steps 7 to 11
+    remove_round_btc_amounts(day_bin_counts)
+    rough_price_estimate = estimate_rough_price(day_bin_counts)
+    output_prices, output_blocks, output_times = create_price_points(rough_price_estimate, day_outputs, day_output_blocks)
+    central_price, price_dn, price_up = find_exact_price(output_prices, rough_price_estimate)
+    return central_price
+
+#a backfill process opens its own connections and can't start processes of its own to
+#parse blocks
+def start_backfill_worker():
+    global parse_workers
+    parse_workers = 1
+    forget_parent_connections()
+
+#find the price of a day, or report the error and answer None so the backfill can go on
+#with the other days. Node errors end the program with sys.exit, which would also end a
+#worker process without an answer, so they're caught too
+def try_find_day_price(day_blocks):
+    try:
+        return find_day_price(day_blocks)
+    except (Exception, SystemExit) as e:
+        day_date = datetime.fromtimestamp(day_blocks[0], tz=timezone.utc).strftime("%Y-%m-%d")
+        print("\nCould not find the price of "+day_date+", it will be tried again on the next run.",flush=True)
+        print("Details:", repr(e),flush=True)
+        return None
+
+#read the days already in the results file, dropping a last line that was cut off
+def read_backfill_csv():
+    done_dates = set()
+    if not os.path.exists(backfill_csv):
+        return done_dates
+    with open(backfill_csv, "r+") as f:
+        csv_text = f.read()
+        complete_text = csv_text[:csv_text.rfind("\n") + 1]
+        if len(complete_text) < len(csv_text):
+            f.truncate(len(complete_text))
+    for line in complete_text.splitlines()[1:]:
+        done_dates.add(line.split(",")[0])
+    return done_dates
+
+#find and save the price of every day not already in the results file
+if backfill_mode:
+    done_dates = read_backfill_csv()
+    days_needed = [day_blocks for day_blocks in backfill_day_blocks if 
+        datetime.fromtimestamp(day_blocks[0], tz=timezone.utc).strftime("%Y-%m-%d") not in done_dates]
+    print("\nFinding the price of "+str(len(days_needed))+" days, "+str(len(backfill_day_blocks) - len(days_needed))+
+        " already in "+backfill_csv,flush=True)
+    
+    with open(backfill_csv, "a") as f:
+        if f.tell() == 0:
+            f.write("date,price,first_block,last_block\n")
+        
+        #work on several days at once if asked, getting the prices back in date order
+        worker_pool = None
+        if parse_workers > 1:
+            worker_pool = multiprocessing.get_context("fork").Pool(parse_workers, initializer=start_backfill_worker)
+            day_prices = worker_pool.imap(try_find_day_price, days_needed)
+        else:
+            day_prices = map(try_find_day_price, days_needed)
+        
+        #save each price as soon as it's found. Checking the size of the saved blocks means
+        #listing every file, so it's done at most once a minute while days are found
+        failed_days = 0
+        last_trim_time = time.time()
+        try:
+            for day_blocks, central_price in zip(days_needed, day_prices):
+                if central_price is None:
+                    failed_days += 1
+                    continue
+                day_seconds, day_start_block, day_end_block = day_blocks
+                day_date = datetime.fromtimestamp(day_seconds, tz=timezone.utc).strftime("%Y-%m-%d")
+                f.write(day_date+","+str(int(central_price))+","+str(day_start_block)+","+str(day_end_block - 1)+"\n")
+                f.flush()
+                print("\t\t"+day_date+" price: $"+f"{int(central_price):,}",flush=True)
+                if block_cache_available and time.time() - last_trim_time > 60:
+                    try:
+                        trim_block_cache()
+                    except OSError:
+                        pass
+                    last_trim_time = time.time()
+            if failed_days > 0:
+                print("\nCould not find the price of "+str(failed_days)+" of the days. Run the same command again to try them again.",flush=True)
+                sys.exit(1)
+        except KeyboardInterrupt:
+            print("\nBackfill stopped. Run the same command again to continue.",flush=True)
+        finally:
+            if worker_pool is not None:
+                worker_pool.terminate()
+            
+            #keep the saved parsed blocks within their size limit
+            if block_cache_available:
+                try:
+                    trim_block_cache()
+                except OSError:
+                    pass
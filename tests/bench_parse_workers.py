@@ -0,0 +1,110 @@
+"""Benchmark Step 6 block parsing on one process and on a pool of --workers processes.
+
+usage: python3 tests/bench_parse_workers.py [BLOCKS] [WORKERS ...]
+
+Builds BLOCKS synthetic blocks (default 48) of about 3000 transactions each and
+serves them from memory in place of the node. parse_blocks_in_order then
+downloads and parses them on one process, and on a fork pool for every worker
+count given (default 2, 4 and the number of cores), where each worker downloads
+its own blocks by hash. Checks that every pool returns exactly what the serial
+parse returned and prints the time of each, and the time the main process spends
+sending hashes to the workers and reading back their results. Needs no node,
+only Linux for the pool.
+"""
+import multiprocessing
+import os
+import pickle
+import random
+import struct
+import sys
+import time
+
+from utxoracle_steps import load_steps
+
+
+def varint(i):
+    if i < 0xfd:
+        return bytes([i])
+    if i <= 0xffff:
+        return b"\xfd" + i.to_bytes(2, "little")
+    return b"\xfe" + i.to_bytes(4, "little")
+
+
+# a transaction with the given inputs (spent txid, script size) and output amounts
+def make_tx(rng, inputs, output_sats, segwit):
+    body = varint(len(inputs))
+    for spent_txid, script_size in inputs:
+        body += spent_txid + struct.pack("<I", rng.randrange(4)) + varint(script_size) + rng.randbytes(script_size) + b"\xff\xff\xff\xff"
+    body += varint(len(output_sats))
+    for amount_sats in output_sats:
+        body += struct.pack("<Q", amount_sats) + b"\x16\x00\x14" + rng.randbytes(20)
+    if not segwit:
+        return struct.pack("<I", 2) + body + struct.pack("<I", 0)
+    witness = b"".join(b"\x02\x48" + rng.randbytes(72) + b"\x21" + rng.randbytes(33) for _ in inputs)
+    return struct.pack("<I", 2) + b"\x00\x01" + body + witness + struct.pack("<I", 0)
+
+
+# a block of mostly two output payments around $42k, some spending earlier txs of the block
+def make_block(seed, tx_count=3000):
+    rng = random.Random(seed)
+    coinbase = make_tx(rng, [(b"\x00" * 32, 20)], [625000000], False)
+    txs = [coinbase]
+    for _ in range(tx_count):
+        inputs = [(rng.randbytes(32), 0) for _ in range(rng.choice([1, 1, 2, 3, 6]))]
+        segwit = rng.random() < 0.75
+        if not segwit:
+            inputs = [(spent_txid, 107) for spent_txid, _ in inputs]
+        output_count = rng.choice([2, 2, 2, 3])
+        payment = int(rng.choice([10, 20, 50, 100]) / 42000 * 1e8)
+        output_sats = [payment] + [int(10 ** rng.uniform(4, 8)) for _ in range(output_count - 1)]
+        txs.append(make_tx(rng, inputs, output_sats, segwit))
+    header = struct.pack("<I", 0x20000000) + rng.randbytes(64) + struct.pack("<III", 1703000000, 0x17034219, 0)
+    return header + varint(len(txs)) + b"".join(txs)
+
+
+def main():
+    block_count = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    worker_counts = [int(w) for w in sys.argv[2:]] or sorted({2, 4, os.cpu_count() or 1})
+    steps = load_steps(5, 6, os=os, struct=struct, use_cache=False, cache_dir="", block_cache_mb=0,
+        use_rest=False, prefetch_depth=1, parse_workers=1, system="Linux", block_hashes_needed=[])
+
+    #the blocks are made before the pool forks, so every worker can serve them too
+    raw_blocks = {"%064x" % seed: make_block(seed) for seed in range(block_count)}
+    block_hashes = list(raw_blocks)
+    steps["get_raw_block"] = raw_blocks.__getitem__
+
+    #the pool sends its function to its processes by name, as a function of the main script
+    sys.modules["__main__"].download_and_parse_block = steps["download_and_parse_block"]
+    megabytes = sum(len(raw_block) for raw_block in raw_blocks.values()) / 1e6
+    print(f"{block_count} blocks, {megabytes:.1f} MB, {os.cpu_count()} cores")
+
+    start = time.perf_counter()
+    expected = list(steps["parse_blocks_in_order"](block_hashes))
+    serial_seconds = time.perf_counter() - start
+    print(f"1 process:  {serial_seconds:6.2f} s")
+
+    #the main process still has to send every hash to a worker and read back what it
+    #kept, which limits the speedup however many cores there are
+    start = time.perf_counter()
+    for block_hash, parsed_block in zip(block_hashes, expected):
+        pickle.loads(pickle.dumps(block_hash))
+        pickle.loads(pickle.dumps(parsed_block))
+    transfer_seconds = time.perf_counter() - start
+    print(f"transfers:  {transfer_seconds:6.2f} s in the main process, so at most "
+        f"{serial_seconds / transfer_seconds:.1f}x with enough cores")
+
+    for workers in worker_counts:
+        steps["parse_workers"] = workers
+        steps["parse_pool"] = multiprocessing.get_context("fork").Pool(workers)
+        try:
+            start = time.perf_counter()
+            parsed_blocks = list(steps["parse_blocks_in_order"](block_hashes))
+            seconds = time.perf_counter() - start
+        finally:
+            steps["parse_pool"].terminate()
+        assert parsed_blocks == expected, "pool parse differs from the serial parse"
+        print(f"{workers} workers: {seconds:6.2f} s  ({serial_seconds / seconds:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Step 4 must put every block in the day of the first midnight at or before its place
+in the chain: a day starts with the first block stamped at or after its midnight.
+This is how the original walk ended every day, and it's checked against that walk
+on a chain whose block times are out of order."""
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from utxoracle_steps import load_steps
+
+SECONDS_IN_A_DAY = 86400
+FIRST_MIDNIGHT = 1702598400     #2023-12-15 00:00:00 UTC
+DAYS = 60
+
+
+# block times about 10 minutes apart, off by up to 5 minutes either way, each later
+# than the median time past of the blocks before it like consensus requires
+def make_chain_times(seed, noise):
+    rng = random.Random(seed)
+    times = []
+    t = FIRST_MIDNIGHT - 2 * SECONDS_IN_A_DAY
+    while t < FIRST_MIDNIGHT + (DAYS + 2) * SECONDS_IN_A_DAY:
+        t += int(rng.expovariate(1 / 600)) + 1
+        block_time = t + rng.randint(-noise, noise)
+        if len(times) >= 11:
+            block_time = max(block_time, sorted(times[-11:])[5] + 1)
+        times.append(block_time)
+
+    #stamp a block exactly at one midnight
+    midnight = FIRST_MIDNIGHT + 10 * SECONDS_IN_A_DAY
+    k = min(range(len(times)), key=lambda h: abs(times[h] - midnight))
+    assert sorted(times[k-11:k])[5] < midnight
+    times[k] = midnight
+    return times
+
+
+def load_search(times):
+    def get_block_times(heights):
+        return [times[h] for h in heights], ["%064x" % h for h in heights]
+
+    def get_block_time(height):
+        return times[height], "%064x" % height
+
+    return load_steps(4, backfill_mode=False, get_block_times=get_block_times,
+        get_block_time=get_block_time, header_index_start=0)["find_first_block_after"]
+
+
+# the original date mode walk, kept as the reference. Returns the first block of the
+# day and the block after its last one
+def original_day_blocks(times, price_day_seconds):
+    def get_day_of_month(time_in_seconds):
+        return int(datetime.fromtimestamp(time_in_seconds, tz=timezone.utc).strftime("%d"))
+
+    block_count_consensus = len(times) - 7
+    latest_time_in_seconds = times[block_count_consensus]
+    seconds_since_price_day = latest_time_in_seconds - price_day_seconds
+    blocks_ago_estimate = round(144*float(seconds_since_price_day)/float(SECONDS_IN_A_DAY))
+    price_day_block_estimate = block_count_consensus - blocks_ago_estimate
+    time_in_seconds = times[price_day_block_estimate]
+    seconds_difference = time_in_seconds - price_day_seconds
+    block_jump_estimate = round(144*float(seconds_difference)/float(SECONDS_IN_A_DAY))
+    last_estimate = 0
+    last_last_estimate = 0
+    while block_jump_estimate > 6 and block_jump_estimate != last_last_estimate:
+        last_last_estimate = last_estimate
+        last_estimate = block_jump_estimate
+        price_day_block_estimate = price_day_block_estimate-block_jump_estimate
+        time_in_seconds = times[price_day_block_estimate]
+        seconds_difference = time_in_seconds - price_day_seconds
+        block_jump_estimate = round(144*float(seconds_difference)/float(SECONDS_IN_A_DAY))
+    if time_in_seconds > price_day_seconds:
+        while time_in_seconds > price_day_seconds:
+            price_day_block_estimate = price_day_block_estimate-1
+            time_in_seconds = times[price_day_block_estimate]
+        price_day_block_estimate = price_day_block_estimate + 1
+    elif time_in_seconds < price_day_seconds:
+        while time_in_seconds < price_day_seconds:
+            price_day_block_estimate = price_day_block_estimate+1
+            time_in_seconds = times[price_day_block_estimate]
+    price_day_block = price_day_block_estimate
+    day1 = get_day_of_month(times[price_day_block])
+    price_day_block_end = price_day_block
+    day2 = day1
+    while day1 == day2:
+        price_day_block_end += 1
+        day2 = get_day_of_month(times[price_day_block_end])
+    return price_day_block, price_day_block_end
+
+
+def first_block_stamped_at(times, midnight):
+    return next(h for h in range(len(times)) if times[h] >= midnight)
+
+
+@pytest.mark.parametrize("noise", [0, 60, 300])
+def test_days_start_at_the_first_block_stamped_at_midnight(noise):
+    times = make_chain_times(noise, noise)
+    find_first_block_after = load_search(times)
+    for day in range(DAYS + 1):
+        midnight = FIRST_MIDNIGHT + day * SECONDS_IN_A_DAY
+        assert find_first_block_after(midnight, 0, len(times) - 1) == first_block_stamped_at(times, midnight)
+
+
+def test_block_stamped_at_midnight_starts_the_day():
+    times = make_chain_times(1, 300)
+    find_first_block_after = load_search(times)
+    midnight = FIRST_MIDNIGHT + 10 * SECONDS_IN_A_DAY
+    assert times[find_first_block_after(midnight, 0, len(times) - 1)] == midnight
+
+
+@pytest.mark.parametrize("noise", [0, 60, 300])
+def test_days_end_where_the_original_walk_ended_them(noise):
+    #the original walk ended a day at the first block stamped on another date, which is
+    #the first block of the next day unless one is stamped before the day's midnight.
+    #It started a day in two ways depending on where its estimate landed, so its starts
+    #could leave blocks out of both days and aren't compared
+    times = make_chain_times(noise, noise)
+    find_first_block_after = load_search(times)
+    compared = 0
+    for day in range(DAYS):
+        midnight = FIRST_MIDNIGHT + day * SECONDS_IN_A_DAY
+        original_start, original_end = original_day_blocks(times, midnight)
+        if times[original_end] < midnight:
+            continue
+        day_end = find_first_block_after(midnight + SECONDS_IN_A_DAY, 0, len(times) - 1)
+        assert day_end == original_end, day
+        compared += 1
+    assert compared > DAYS * 0.9
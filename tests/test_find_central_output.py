@@ -0,0 +1,106 @@
+"""Step 11 find_central_output must give the same central price and MAD as the
+original function, including which middle point wins for even counts."""
+import itertools
+import random
+
+import pytest
+
+from utxoracle_steps import load_steps
+
+find_central_output = load_steps(11)["find_central_output"]
+
+
+# the Step 11 function before it was rewritten, kept as the reference
+def original_find_central_output(r2, price_min, price_max):
+
+    #sort the list of prices
+    r6 = [r for r in r2 if price_min < r < price_max]
+    outputs = sorted(r6)
+    n = len(outputs)
+
+    # Prefix sums
+    prefix_sum = []
+    total = 0
+    for x in outputs:
+        total += x
+        prefix_sum.append(total)
+
+    # count the number of point left and right
+    left_counts = list(range(n))
+    right_counts = [n - i - 1 for i in left_counts]
+    left_sums = [0] + prefix_sum[:-1]
+    right_sums = [total - x for x in prefix_sum]
+
+    # find the total distance to other points
+    total_dists = []
+    for i in range(n):
+        dist = (outputs[i] * left_counts[i] - left_sums[i]) + (right_sums[i] - outputs[i] * right_counts[i])
+        total_dists.append(dist)
+
+    # find the Most central output
+    min_index, _ = min(enumerate(total_dists), key=lambda x: x[1])
+    best_output = outputs[min_index]
+
+    # Median absolute deviation
+    deviations = [abs(x - best_output) for x in outputs]
+    deviations.sort()
+    m = len(deviations)
+    if m % 2 == 0:
+        mad = (deviations[m//2 - 1] + deviations[m//2]) / 2
+    else:
+        mad = deviations[m//2]
+
+    return best_output, mad
+
+
+def check_same(prices, price_min, price_max):
+    expected = original_find_central_output(prices, price_min, price_max)
+    assert find_central_output(sorted(prices), price_min, price_max) == expected
+
+
+@pytest.mark.parametrize("values", [
+    [1.0, 2.0, 2.5, 3.0, 7.0, 7.25],
+    [0.1, 0.2, 0.3, 0.7, 1.1, 1.3],
+    [41999.97, 42000.0, 42000.01, 42000.3, 42001.7, 42003.9],
+])
+def test_every_small_multiset(values):
+    for count in range(1, 8):
+        for prices in itertools.combinations_with_replacement(values, count):
+            prices = list(prices)
+            check_same(prices, 0.0, 100000.0)
+
+            #window bounds are exclusive and may cut off points at both ends
+            for price_min, price_max in ((values[0], values[-1]), (values[1], values[-2])):
+                if any(price_min < p < price_max for p in prices):
+                    check_same(prices, price_min, price_max)
+
+
+def test_random_windows():
+    rng = random.Random(7)
+    for _ in range(3000):
+        prices = [rng.uniform(40000, 45000) for _ in range(rng.randrange(1, 200))]
+        if rng.random() < 0.5:
+            prices = [round(p, rng.choice([0, 1, 2])) for p in prices]
+        if any(41000 < p < 44000 for p in prices):
+            check_same(prices, 41000, 44000)
+
+
+def test_usd_price_points():
+    #price points are round usd amounts divided by btc amounts, like step 10 makes
+    rng = random.Random(11)
+    for _ in range(300):
+        prices = []
+        for _ in range(rng.randrange(2, 400, 2)):
+            usd = rng.choice([5, 10, 20, 50, 100])
+            sats = int(usd / rng.gauss(42000, 300) * 1e8)
+            prices.append(usd * 100000000 / sats)
+        check_same(prices, 42000 * .95, 42000 * 1.05)
+
+
+def test_empty_window_raises_like_before():
+    with pytest.raises(ValueError):
+        original_find_central_output([1.0, 5.0], 2.0, 4.0)
+    with pytest.raises(ValueError):
+        find_central_output([1.0, 5.0], 2.0, 4.0)
+    with pytest.raises(ValueError):
+        find_central_output([], 2.0, 4.0)
@@ -0,0 +1,53 @@
+"""Step 5's integer sat bin edges must put every output in the same histogram
+bin as the original log10 estimate and correction loop."""
+from bisect import bisect_right
+from math import log10
+
+from utxoracle_steps import load_steps
+
+step5 = load_steps(5)
+output_histogram_bins = step5["output_histogram_bins"]
+output_histogram_bin_sats = step5["output_histogram_bin_sats"]
+number_of_bins = step5["number_of_bins"]
+first_bin_value = step5["first_bin_value"]
+range_bin_values = step5["range_bin_values"]
+
+
+# the original bin lookup on the btc amount, kept as the reference
+def original_bin_number(amount):
+    amount_log = log10(amount)
+    percent_in_range = (amount_log - first_bin_value) / range_bin_values
+    bin_number_est = int(percent_in_range * number_of_bins)
+    while output_histogram_bins[bin_number_est] <= amount:
+        bin_number_est += 1
+    return bin_number_est - 1
+
+
+def sat_bin_number(amount_sats):
+    return bisect_right(output_histogram_bin_sats, amount_sats) - 1
+
+
+# the original parser only binned outputs with 1e-5 < btc amount < 1e5
+def in_original_range(amount_sats):
+    return 1e-5 < amount_sats / 1e8 < 1e5
+
+
+def test_edges_are_smallest_sat_amounts_in_their_bin():
+    for bin_value, edge_sats in zip(output_histogram_bins, output_histogram_bin_sats):
+        assert edge_sats / 1e8 >= bin_value
+        assert edge_sats == 0 or (edge_sats - 1) / 1e8 < bin_value
+
+
+def test_every_edge():
+    checked = 0
+    for edge_sats in output_histogram_bin_sats:
+        for amount_sats in range(edge_sats - 3, edge_sats + 4):
+            if in_original_range(amount_sats):
+                assert sat_bin_number(amount_sats) == original_bin_number(amount_sats / 1e8), amount_sats
+                checked += 1
+    assert checked > 1900 * 7
+
+
+def test_every_amount_in_the_first_decades():
+    for amount_sats in range(1001, 200001):
+        assert sat_bin_number(amount_sats) == original_bin_number(amount_sats / 1e8), amount_sats
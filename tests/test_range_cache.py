@@ -0,0 +1,62 @@
+"""Step 6 block range files must give back exactly the histogram and outputs that
+were saved, and be ignored when they are cut off or saved by another parser."""
+import os
+import random
+import struct
+import sys
+
+import pytest
+
+from utxoracle_steps import load_steps
+
+FIRST_HASH = "00" * 31 + "01"
+LAST_HASH = "00" * 31 + "90"
+
+
+@pytest.fixture
+def steps(tmp_path):
+    return load_steps(5, 6, os=os, struct=struct, sys=sys, use_cache=True, cache_dir=str(tmp_path),
+        block_cache_mb=2000, use_rest=False, prefetch_depth=1, parse_workers=1, system="Linux",
+        block_hashes_needed=[])
+
+
+# a histogram and outputs like sum_block_range makes for a day of blocks
+def make_block_range(steps):
+    rng = random.Random(3)
+    outputs = steps["array"]('Q')
+    output_blocks = []
+    for height in range(821406, 821545):
+        first_output = len(outputs)
+        outputs.extend(int(10 ** rng.uniform(3.01, 9)) for _ in range(rng.randrange(0, 400)))
+        if len(outputs) > first_output:
+            output_blocks.append((first_output, len(outputs), height, 1702857600 + 600 * (height - 821406)))
+    bin_counts = [0.0] * steps["number_of_bins"]
+    for amount_sats in outputs:
+        bin_counts[steps["bisect_right"](steps["output_histogram_bin_sats"], amount_sats) - 1] += 1.0
+    return bin_counts, outputs, output_blocks
+
+
+def save(steps, block_range):
+    os.makedirs(steps["range_cache_dir"], exist_ok=True)
+    steps["save_range_cache"]([FIRST_HASH, LAST_HASH], *block_range)
+    return steps["range_cache_path"]([FIRST_HASH, LAST_HASH])
+
+
+def test_saved_range_reads_back_the_same(steps):
+    block_range = make_block_range(steps)
+    save(steps, block_range)
+    assert steps["read_range_cache"]([FIRST_HASH, LAST_HASH]) == block_range
+    assert steps["read_range_cache"]([FIRST_HASH, FIRST_HASH]) is None
+
+
+def test_cut_off_range_file_is_ignored(steps):
+    path = save(steps, make_block_range(steps))
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 1)
+    assert steps["read_range_cache"]([FIRST_HASH, LAST_HASH]) is None
+
+
+def test_range_file_of_another_parser_is_ignored(steps):
+    save(steps, make_block_range(steps))
+    steps["parser_version"] += 1
+    assert steps["read_range_cache"]([FIRST_HASH, LAST_HASH]) is None
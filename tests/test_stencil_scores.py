@@ -0,0 +1,112 @@
+"""Step 9's stencil scores must match the original sliding loop, and the NumPy
+and pure Python backends of slide_stencil_scores must pick the same slides."""
+import random
+from bisect import bisect_right
+
+import pytest
+
+from utxoracle_steps import load_steps
+
+steps = load_steps(5, 7, 8, 9)
+slide_stencil_scores = steps["slide_stencil_scores"]
+estimate_rough_price = steps["estimate_rough_price"]
+remove_round_btc_amounts = steps["remove_round_btc_amounts"]
+smooth_stencil = steps["smooth_stencil"]
+spike_stencil = steps["spike_stencil"]
+min_slide = steps["min_slide"]
+max_slide = steps["max_slide"]
+left_p001 = steps["left_p001"]
+right_p001 = steps["right_p001"]
+
+
+# the original Step 9 loop, kept as the reference. Returns every slide score and the best slide
+def original_slide_scores(output_histogram_bin_counts):
+    best_slide = 0
+    best_slide_score = 0
+    slide_scores = []
+    for slide in range(min_slide, max_slide):
+        shifted_curve = output_histogram_bin_counts[left_p001+slide:right_p001+slide]
+        slide_score_smooth = 0.0
+        for n in range(0, len(smooth_stencil)):
+            slide_score_smooth += shifted_curve[n]*smooth_stencil[n]
+        slide_score = 0.0
+        for n in range(0, len(spike_stencil)):
+            slide_score += shifted_curve[n]*spike_stencil[n]
+        if slide < 150:
+            slide_score = slide_score + slide_score_smooth*.65
+        if slide_score > best_slide_score:
+            best_slide_score = slide_score
+            best_slide = slide
+        slide_scores.append(slide_score)
+    return slide_scores, best_slide
+
+
+# the slide scores the same way estimate_rough_price adds them up
+def engine_slide_scores(bin_counts):
+    spike_scores = slide_stencil_scores(bin_counts, spike_stencil, min_slide-1, max_slide+1)
+    smooth_scores = slide_stencil_scores(bin_counts, smooth_stencil, min_slide, 150)
+    slide_scores = []
+    for slide in range(min_slide, max_slide):
+        slide_score = spike_scores[slide-min_slide+1]
+        if slide < 150:
+            slide_score = slide_score + smooth_scores[slide-min_slide]*.65
+        slide_scores.append(slide_score)
+    best_slide = min_slide + max(range(len(slide_scores)), key=lambda k: (slide_scores[k], -k))
+    return slide_scores, best_slide
+
+
+# a normalized histogram of round usd payments at a price, with change outputs as noise
+def make_histogram(price, seed):
+    rng = random.Random(seed)
+    bin_counts = [0.0] * steps["number_of_bins"]
+    for _ in range(20000):
+        if rng.random() < 0.4:
+            usd = rng.choice([5, 10, 20, 50, 100, 200, 500, 1000])
+            amount_sats = int(usd / (price * (1 + rng.gauss(0, 0.003))) * 1e8)
+        else:
+            amount_sats = int(10 ** rng.uniform(4, 9))
+        bin_counts[bisect_right(steps["output_histogram_bin_sats"], amount_sats) - 1] += 1.0
+    remove_round_btc_amounts(bin_counts)
+    return bin_counts
+
+
+HISTOGRAMS = [make_histogram(price, seed) for seed, price in enumerate([12000, 27000, 42000, 65000, 98000, 150000])]
+
+
+def use_backend(numpy_module):
+    steps["numpy"] = numpy_module
+
+
+@pytest.fixture
+def pure_python():
+    saved = steps["numpy"]
+    use_backend(None)
+    yield
+    use_backend(saved)
+
+
+@pytest.mark.parametrize("bin_counts", HISTOGRAMS)
+def test_pure_python_matches_original_loop(bin_counts, pure_python):
+    expected_scores, expected_best = original_slide_scores(bin_counts)
+    scores, best = engine_slide_scores(bin_counts)
+    assert scores == pytest.approx(expected_scores, rel=1e-12, abs=1e-15)
+    assert best == expected_best
+
+
+@pytest.mark.parametrize("bin_counts", HISTOGRAMS)
+def test_numpy_matches_pure_python(bin_counts):
+    numpy = pytest.importorskip("numpy")
+    saved = steps["numpy"]
+    try:
+        use_backend(None)
+        python_scores, python_best = engine_slide_scores(bin_counts)
+        python_price = estimate_rough_price(bin_counts)
+        use_backend(numpy)
+        numpy_scores, numpy_best = engine_slide_scores(bin_counts)
+        numpy_price = estimate_rough_price(bin_counts)
+    finally:
+        use_backend(saved)
+    assert numpy_scores == pytest.approx(python_scores, rel=1e-12, abs=1e-15)
+    assert numpy_best == python_best
+    assert numpy_price == python_price
+    assert numpy_best == original_slide_scores(bin_counts)[1]
@@ -0,0 +1,48 @@
+"""Run single steps of UTXOracle.py for the tests.
+
+UTXOracle.py runs top to bottom and talks to a node as soon as it starts, so it
+can't be imported. Instead the tests cut the steps they need out of the script
+and run them in a fresh namespace. Backfill mode is switched on so the steps
+only define their tables and functions and skip the work of a normal run.
+"""
+import os
+import re
+from array import array
+from bisect import bisect_right
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "UTXOracle.py")
+
+
+def step_source(source, step):
+    """Return the source of one step, from its banner up to the next banner.
+
+    The lines before the step are kept as blank lines so that tracebacks show
+    the line numbers of UTXOracle.py.
+    """
+    banner = re.compile(r"^#{20,}\s*\n\s*\n#\s+Step " + str(step) + r"\s+-", re.M)
+    start = banner.search(source).start()
+    next_banner = re.compile(r"^#{20,}\s*\n\s*\n#\s+Step \d+\s+-", re.M).search(source, start + 1)
+    end = next_banner.start() if next_banner else len(source)
+    return "\n" * source.count("\n", 0, start) + source[start:end]
+
+
+def load_steps(*steps, **variables):
+    """Run the given steps in order and return the namespace they made.
+
+    Keyword arguments become variables the steps can read, which can also
+    override the defaults below.
+    """
+    with open(SCRIPT_PATH) as f:
+        source = f.read()
+    namespace = {
+        "backfill_mode": True,
+        "date_mode": False,
+        "block_mode": False,
+        "daemon_mode": False,
+        "bisect_right": bisect_right,
+        "array": array,
+    }
+    namespace.update(variables)
+    for step in steps:
+        exec(compile(step_source(source, step), SCRIPT_PATH, "exec"), namespace)
+    return namespace